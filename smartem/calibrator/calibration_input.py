@@ -49,14 +49,17 @@ class CalibrationInfluxDbInput(InfluxDbInput):
         if self.df is None or not self.cache_result:
             dfs = []
             while True:
-                db_ret = self.query_db(self.query % self.last_timestamp)
-                if len(db_ret) > 0:
+                count = 0
+                for db_ret in self.query_db_batches(self.query % self.last_timestamp):
+                    count += len(db_ret)
                     self.last_timestamp = db_ret[-1]['time']
-                    log.info('Last timestamp from influxdb is %s' % self.last_timestamp)
                     df = pd.DataFrame.from_records(db_ret)
                     df = df.pivot_table('value', ['geohash', 'time'],
                                         'component').reset_index()
                     dfs.append(df)
+
+                if count > 0:
+                    log.info('Last timestamp from influxdb is %s' % self.last_timestamp)
                 else:
                     break
             self.df = pd.concat(dfs)
@@ -68,6 +71,25 @@ class CalibrationInfluxDbInput(InfluxDbInput):
 
         return packet
 
+    def query_db_batches(self, query):
+        # Query results as lists of points, with chunk_size per chunk (streamed).
+        # Chunks are cut on time change such that pivoting per chunk does not split a time.
+        if self.chunk_size <= 0:
+            db_ret = self.query_db(query)
+            if len(db_ret) > 0:
+                yield db_ret
+            return
+
+        points = []
+        for point in self.query_db_iter(query):
+            if len(points) >= self.chunk_size and point['time'] != points[-1]['time']:
+                yield points
+                points = []
+            points.append(point)
+
+        if len(points) > 0:
+            yield points
+
 
 class CalibrationDataInput(FileInput):
     def __init__(self, configdict, section, produces=FORMAT.record):
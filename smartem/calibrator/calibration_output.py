@@ -5,11 +5,14 @@ import sys
 
 from stetl.outputs.dboutput import PostgresInsertOutput
 from stetl.outputs.fileoutput import FileOutput
+from stetl.component import Config
 from stetl.util import Util
 
 import pandas as pd
 import psycopg2
 
+from smartem.util.mlp import NumpyMLP
+
 log = Util.get_log('Calibration output')
 
 
@@ -29,6 +32,21 @@ class CalibrationDataOutput(FileOutput):
 
 
 class CalibrationModelOutput(PostgresInsertOutput):
+    """
+    Saves the calibration model (pickled sklearn Pipeline) with its parameters.
+    Optionally also saves the model in compact (JSON) format for the NumPy runtime.
+    """
+
+    @Config(ptype=str, default=None, required=False)
+    def compact_model_column(self):
+        """
+        Column to save the compact (JSON) model format in, see smartem.util.mlp.NumpyMLP.
+        Not saved if not set.
+
+        Required: False
+
+        Default: None
+        """
 
     def before_invoke(self, packet):
         result_in = packet.data
@@ -42,6 +60,10 @@ class CalibrationModelOutput(PostgresInsertOutput):
         result_out['n'] = result_in['sample'].shape[0]
         result_out['input_order'] = json.dumps(result_in['column_order'])
 
+        if self.compact_model_column:
+            compact_model = NumpyMLP.from_pipeline(result_in['best_estimator_'])
+            result_out[self.compact_model_column] = json.dumps(compact_model)
+
         packet.data = result_out
 
         return packet
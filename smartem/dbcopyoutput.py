@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# Bulk Postgres output: COPY records into a staging table and merge into the target table.
+#
+# Author: Just van den Broecke
+
+import json
+from io import BytesIO
+
+from stetl.component import Config
+from stetl.util import Util
+from stetl.outputs.dboutput import PostgresInsertOutput
+
+log = Util.get_log("PostgresCopyOutput")
+
+
+class PostgresCopyOutput(PostgresInsertOutput):
+    """
+    Drop-in for PostgresInsertOutput that writes records in bulk: records are streamed
+    with COPY FROM STDIN into a temporary staging table and then merged into the target table
+    with a single INSERT, using ON CONFLICT (key) DO UPDATE if replace is True and key is in the records.
+    Upserts require PostgreSQL 9.5+ and a unique constraint or index on key.
+    Each group of records is committed separately. On an error the failed and remaining
+    records stay buffered and the error is raised.
+    """
+
+    @Config(ptype=int, required=False, default=0)
+    def flush_size(self):
+        """
+        Number of records to gather (over packets) before writing. 0 means write per packet.
+        Remaining records are written at end of stream and exit.
+        """
+        pass
+
+    def __init__(self, configdict, section):
+        PostgresInsertOutput.__init__(self, configdict, section)
+        self.records = []
+
+    def exit(self):
+        try:
+            self.flush()
+        finally:
+            PostgresInsertOutput.exit(self)
+
+    def write(self, packet):
+        if packet.data:
+            if type(packet.data) is list:
+                self.records.extend(packet.data)
+            else:
+                self.records.append(packet.data)
+
+        if len(self.records) >= self.flush_size or packet.is_end_of_stream():
+            self.flush()
+
+        return packet
+
+    def flush(self):
+        if len(self.records) == 0:
+            return
+
+        # Records may differ in columns: write consecutive records with same columns together
+        records = self.records
+        start = 0
+        try:
+            for i in range(1, len(records) + 1):
+                if i == len(records) or set(records[i]) != set(records[start]):
+                    self.copy_records(records[start:i])
+                    self.db.commit(close=False)
+                    start = i
+        finally:
+            # Keep failed and unwritten records
+            self.records = records[start:]
+
+    def copy_records(self, records):
+        table = self.cfg.get('table')
+        columns = list(records[0])
+        column_list = ','.join(columns)
+        upsert = self.replace and self.key in columns
+        if upsert:
+            records = self.unique_records(records)
+
+        stage = 'staging_%s' % table.split('.')[-1]
+        try:
+            self.db.cursor.execute('CREATE TEMP TABLE %s AS SELECT %s FROM %s WITH NO DATA' % (stage, column_list, table))
+            self.db.cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (stage, column_list),
+                                       self.to_csv(columns, records))
+
+            query = 'INSERT INTO %s (%s) SELECT %s FROM %s' % (table, column_list, column_list, stage)
+            if upsert:
+                updates = ','.join(['%s=EXCLUDED.%s' % (column, column) for column in columns if column != self.key])
+                if updates:
+                    query += ' ON CONFLICT (%s) DO UPDATE SET %s' % (self.key, updates)
+                else:
+                    query += ' ON CONFLICT (%s) DO NOTHING' % self.key
+
+            self.db.cursor.execute(query)
+            self.db.cursor.execute('DROP TABLE %s' % stage)
+        except Exception as e:
+            log.error('Error writing %d records to %s: %s' % (len(records), table, str(e)))
+            self.db.connection.rollback()
+            raise
+
+        log.info('written %d records to %s' % (len(records), table))
+
+    def unique_records(self, records):
+        # Records with same key: last one wins (as with record by record UPDATE/INSERT)
+        positions = dict()
+        for i, record in enumerate(records):
+            positions[record[self.key]] = i
+
+        return [record for i, record in enumerate(records) if positions[record[self.key]] == i]
+
+    @staticmethod
+    def to_csv(columns, records):
+        lines = []
+        for record in records:
+            lines.append(','.join([PostgresCopyOutput.to_csv_value(record[column]) for column in columns]))
+
+        return BytesIO('\n'.join(lines) + '\n')
+
+    @staticmethod
+    def to_csv_value(value):
+        # NULL is unquoted empty, all other values quoted
+        if value is None:
+            return ''
+
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, float):
+            value = repr(value)
+        else:
+            value = str(value)
+
+        return '"%s"' % value.replace('"', '""')
@@ -25,6 +25,11 @@ class AirSensEUR(Device):
     def exit(self):
         pass
 
+    def supports_columnar(self):
+        # Each sample has a single sensor (name) and gas converters need last values
+        # of other sensors (e.g. temperature) from earlier samples: refine sample by sample.
+        return False
+
     def can_resolve(self, sensor_name, val_dict):
         sensor_def = self.get_sensor_def(sensor_name)
         if not sensor_def:
@@ -46,6 +51,40 @@ class AirSensEUR(Device):
 
         return result
 
+    def get_resolver(self, sensor_name):
+        # Resolvable when all inputs in chain end in the sensor name of the sample
+        leaf_names = self.get_leaf_names(sensor_name)
+        if leaf_names is not None and len(leaf_names) == 0:
+            return None
+
+        if leaf_names is None or len(leaf_names) > 1:
+            return lambda val_dict: False
+
+        leaf_name = leaf_names.pop()
+        return lambda val_dict: val_dict['name'] == leaf_name
+
+    def get_leaf_names(self, sensor_name):
+        # Set of sensor names without input (last in chain), None if chain has undefined sensor
+        sensor_def = self.get_sensor_def(sensor_name)
+        if not sensor_def:
+            return None
+
+        if 'input' not in sensor_def:
+            return set([sensor_name])
+
+        input_list = sensor_def['input']
+        if type(input_list) is str:
+            input_list = [input_list]
+
+        leaf_names = set()
+        for input_name in input_list:
+            input_leaf_names = self.get_leaf_names(input_name)
+            if input_leaf_names is None:
+                return None
+            leaf_names |= input_leaf_names
+
+        return leaf_names
+
     def get_sensor_defs(self):
         return SENSOR_DEFS
 
@@ -129,6 +168,14 @@ class AirSensEUR(Device):
             pass
         return None
 
+    def get_device_state(self, device_ids):
+        # Last values of devices
+        device_ids = [str(device_id) for device_id in device_ids]
+        return dict((device_id, self.last_values[device_id]) for device_id in device_ids if device_id in self.last_values)
+
+    def set_device_state(self, state):
+        self.last_values.update(state)
+
     def set_last_value(self, device_id, name, value, val_dict):
         try:
             # Best effort
@@ -6,6 +6,7 @@
 # Author: Just van den Broecke - 2015-2018
 
 import logging
+import numpy
 
 log = logging.getLogger('Device')
 
@@ -28,6 +29,21 @@ class Device:
     def can_resolve(self, sensor_name, val_dict):
         return True
 
+    def get_resolver(self, sensor_name):
+        """
+        Get function with val_dict as argument, precompiled equivalent of can_resolve() for sensor_name.
+        None means sensor_name can always be resolved.
+        """
+        return None
+
+    def supports_columnar(self):
+        """
+        Can raw records for this device be refined per sensor over all samples (see Refiner.refine_columnar())?
+        Requires that can_resolve() does not depend on the sample and that converters do not depend
+        on (last) values of other sensors in earlier samples.
+        """
+        return True
+
     def get_type(self):
         return self.device_type
 
@@ -59,9 +75,54 @@ class Device:
         log.error('No check_value defined for base class Device')
         return None
 
+    # Get column (NumPy array) of raw values, columnar equivalent of get_raw_value()
+    def get_raw_column(self, name, columns):
+        if type(name) is list:
+            name = name[0]
+
+        return columns.get(name), name
+
+    # Check column of raw values for name, columnar equivalent of check_value()
+    # Returns boolean array, True for valid values. For list of names all need to be valid.
+    def check_column(self, name, columns):
+        if type(name) is list:
+            valid = numpy.ones(len(columns), dtype=bool)
+            for n in name:
+                valid &= self.check_column(n, columns)
+            return valid
+
+        return self.check_values(name, columns.get(name))
+
+    # Check array of values against min/max of Sensor Def, NaN values are invalid.
+    def check_values(self, name, values):
+        sensor_defs = self.get_sensor_defs()
+        if name not in sensor_defs:
+            return numpy.zeros(len(values), dtype=bool)
+
+        name_def = sensor_defs[name]
+        valid = ~numpy.isnan(values)
+        with numpy.errstate(invalid='ignore'):
+            if 'min' in name_def:
+                valid &= values >= name_def['min']
+
+            if 'max' in name_def:
+                valid &= values <= name_def['max']
+
+        return valid
+
     def get_last_value(self, device_id, name, val_dict):
         return None
 
+    def get_device_state(self, device_ids):
+        """
+        Get state kept for devices (e.g. calibration state or last values), see set_device_state().
+        Used to merge state from Refiner worker processes.
+        """
+        return {}
+
+    def set_device_state(self, state):
+        pass
+
     def set_last_value(self, device_id, name, value, val_dict):
         pass
 
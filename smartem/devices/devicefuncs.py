@@ -3,6 +3,40 @@ from smartem.util.utc import zulu_to_gmt
 # Generic conversion functions for all sensors.
 
 
+def column_converter(column_func):
+    """
+    Decorator to attach a column variant to a (scalar) converter function.
+    The column variant converts a NumPy float array of raw values at once, returning NaN where the
+    converter returns None. Used by Refiner.refine_columnar(), converters without
+    column variant are called value by value.
+
+    :param column_func: function converting array of raw values
+    :return: decorator
+    """
+    def decorate(func):
+        func.column_func = column_func
+        return func
+
+    return decorate
+
+
+def batch_converter(batch_func):
+    """
+    Decorator to attach a batch variant to a (scalar) converter function.
+    The batch variant converts a list of samples in sample order at once, with the same
+    results as calling the converter per sample. Used by Refiner.refine_columnar().
+
+    :param batch_func: function(inputs, json_objs, sensor_def, device) returning list of (value, error) tuples
+    :return: decorator
+    """
+    def decorate(func):
+        func.batch_func = batch_func
+        return func
+
+    return decorate
+
+
+@column_converter(lambda values: values)
 def convert_none(value, record_in=None, sensor_def=None, device=None):
     """
     Null operation: no conversion.
@@ -28,15 +62,18 @@ def convert_zulu_to_gmt(input, json_obj=None, sensor_def=None, device=None):
     return zulu_to_gmt(input)
 
 
+@column_converter(lambda values: values / 1000.0)
 def ohm_to_kohm(input, json_obj=None, sensor_def=None, device=None):
     return float(input) / 1000.0
 
 
+@column_converter(lambda values: values / 1000.0)
 def ppb_to_ppm(input, json_obj=None, sensor_def=None, device=None):
     return input / 1000.0
 
 
 # e.g. for PM10 and PM2_5
+@column_converter(lambda values: values / 1000.0)
 def nanogram_to_microgram(input, json_obj=None, sensor_def=None, device=None):
     return float(input) / 1000.0
 
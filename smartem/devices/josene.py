@@ -7,10 +7,12 @@
 import json
 import logging
 import pickle
+import numpy
 from device import Device
 from stetl.postgis import PostGIS
 from josenedefs import SENSOR_DEFS
 from smartem.util.running_mean import RunningMean
+from smartem.util.mlp import NumpyMLP
 
 log = logging.getLogger('JoseneDevice')
 
@@ -20,6 +22,7 @@ class Josene(Device):
     def __init__(self):
         Device.__init__(self, 'jose')
         self.model_query = "SELECT id,parameters,model from calibration_models WHERE predicts = '%s' AND invalid = FALSE ORDER BY timestamp DESC LIMIT 1"
+        self.compact_model_query = "SELECT id,parameters,%s from calibration_models WHERE predicts = '%s' AND invalid = FALSE ORDER BY timestamp DESC LIMIT 1"
         self.state_query = "SELECT state from calibration_state WHERE process = '%s' AND model_id = %d ORDER BY timestamp DESC LIMIT 1"
         self.state_insert = "INSERT INTO calibration_state (process, model_id, state) VALUES ('%s', %d, '%s')"
         self.sensor_model_names = {
@@ -28,11 +31,15 @@ class Josene(Device):
             'o3': 'ozone__air_'
         }
         self.config_dict = None
+        self.calibration_runtime = 'sklearn'
+        self.compact_model_column = None
 
     def init(self, config_dict):
 
         self.config_dict = config_dict
         self.process_name = config_dict['process_name']
+        self.calibration_runtime = config_dict.get('calibration_runtime', 'sklearn')
+        self.compact_model_column = config_dict.get('compact_model_column', None)
         self.db = PostGIS(config_dict)
         self.db.connect()
 
@@ -82,6 +89,23 @@ class Josene(Device):
     def get_sensor_defs(self):
         return SENSOR_DEFS
 
+    def get_device_state(self, device_ids):
+        # Running mean calibration state of devices per calibrated sensor
+        device_ids = [str(device_id) for device_id in device_ids]
+        result = dict()
+        for k in self.sensor_model_names:
+            state = SENSOR_DEFS[k]['converter_model']['state'] or {}
+            result[k] = dict((device_id, state[device_id]) for device_id in device_ids if device_id in state)
+
+        return result
+
+    def set_device_state(self, state):
+        for k in state:
+            model = SENSOR_DEFS[k]['converter_model']
+            if model['state'] is None:
+                model['state'] = dict()
+            model['state'].update(state[k])
+
     def raw_query(self, query_str):
         self.db.execute(query_str)
 
@@ -91,12 +115,28 @@ class Josene(Device):
         return db_records
 
     def query_model(self, name):
+        if self.calibration_runtime == 'numpy' and self.compact_model_column:
+            # Compact model: no need to unpickle (and import) sklearn
+            query = self.compact_model_query % (self.compact_model_column, name)
+            log.info('Getting compact calibration model with query: %s' % query)
+            ret = self.raw_query(query)
+            if len(ret) > 0 and ret[0][2] is not None:
+                id, parameters, model = ret[0]
+                if not isinstance(model, dict):
+                    model = json.loads(model)
+                return id, parameters, NumpyMLP.from_dict(model)
+
+            log.info('No compact model found for %s, using pickled model' % name)
+
         query = self.model_query % name
         log.info('Getting calibration model with query: %s' % query)
         ret = self.raw_query(query)
         if len(ret) > 0:
             id, parameters, model = ret[0]
-            return id, parameters, pickle.loads(model)
+            model = pickle.loads(model)
+            if self.calibration_runtime == 'numpy':
+                model = NumpyMLP.from_pipeline(model)
+            return id, parameters, model
         else:
             log.warn("No model found for %s" % name)
             return None, {}, {}
@@ -203,6 +243,34 @@ class Josene(Device):
 
         return True, '%s OK' % name
 
+    # Get column of raw sensor values, columnar equivalent of get_raw_value()
+    def get_raw_column(self, name, columns):
+        column, name = Device.get_raw_column(self, name, columns)
+
+        if 'audio' in name:
+            # We may have audio encoded in 3 bands, take first band
+            present = ~numpy.isnan(column)
+            bands = numpy.where(present, column, 0).astype(numpy.int64)
+            column = numpy.where(present, bands & 255, numpy.nan)
+
+        return column, name
+
+    # Check column of sensor values, columnar equivalent of check_value()
+    def check_values(self, name, values):
+        if 'audio' in name and name in SENSOR_DEFS:
+            # Audio inputs: unpack 3 bands, only invalid if all bands outside range
+            name_def = SENSOR_DEFS[name]
+            present = ~numpy.isnan(values)
+            packed = numpy.where(present, values, 0).astype(numpy.int64)
+            valid = numpy.zeros(len(values), dtype=bool)
+            for shift in [0, 8, 16]:
+                band_vals = (packed >> shift) & 255
+                valid |= (band_vals >= name_def['min']) & (band_vals <= name_def['max'])
+
+            return present & valid
+
+        return Device.check_values(self, name, values)
+
     # Get location as lon, lat
     def get_lon_lat(self, val_dict):
         result = (None, None)
@@ -1,7 +1,7 @@
 import math
 import re
 
-import pandas as pd
+import numpy
 
 from smartem.util.running_mean import RunningMean
 from devicefuncs import *
@@ -25,8 +25,7 @@ def update_running_mean(running_means, alpha, obs):
     return running_means
 
 
-def ohm_to_ugm3(input, json_obj, sensor_def, device=None):
-
+def get_converter_model(sensor_def):
     # check model specification
     if not ('converter_model' in sensor_def
             and sensor_def['converter_model'] is not None
@@ -35,9 +34,11 @@ def ohm_to_ugm3(input, json_obj, sensor_def, device=None):
             and 'state' in sensor_def['converter_model']):
         raise ValueError('Converter model not properly specified.')
 
+    return sensor_def['converter_model']
+
+
+def filter_inputs(json_obj, sensor_def, converter_model):
     # unpack model specification
-    converter_model = sensor_def['converter_model']
-    mlp_regressor = converter_model['mlp_regressor']
     running_mean_weights = converter_model['running_mean_weights']
     running_mean_state = converter_model['state']
 
@@ -45,8 +46,6 @@ def ohm_to_ugm3(input, json_obj, sensor_def, device=None):
     if json_obj['device_id'] not in running_mean_state:
         running_mean_state[json_obj['device_id']] = dict()
 
-    val = None
-
     # filter observations
     state = running_mean_state[json_obj['device_id']]
     for component, weight in running_mean_weights.iteritems():
@@ -55,23 +54,64 @@ def ohm_to_ugm3(input, json_obj, sensor_def, device=None):
         json_obj[component] = state[component].observe(json_obj[component])
 
     # select inputs
-    inputs = [json_obj[k] for k in sensor_def['input']]
+    return [json_obj[k] for k in sensor_def['input']]
+
+
+def ohm_to_ugm3(input, json_obj, sensor_def, device=None):
+    converter_model = get_converter_model(sensor_def)
+    mlp_regressor = converter_model['mlp_regressor']
+
+    val = None
+    inputs = filter_inputs(json_obj, sensor_def, converter_model)
 
     # Predict RIVM value if all values are available
-    x = pd.DataFrame([inputs])
+    x = numpy.array([inputs], dtype=float)
     val = mlp_regressor.predict(x)[0]
 
     return val
 
 
+def ohm_to_ugm3_batch(inputs, json_objs, sensor_def, device=None):
+    """
+    Batch variant of ohm_to_ugm3(): filter all samples in sample order (updating
+    running mean state as per sample), then a single predict for all samples.
+    Samples with missing or non-finite inputs fail as in ohm_to_ugm3(), others are still predicted.
+
+    :return: list of (value, error) tuples, error is the Exception for a sample that failed.
+    """
+    converter_model = get_converter_model(sensor_def)
+    mlp_regressor = converter_model['mlp_regressor']
+
+    results = list()
+    rows = list()
+    for json_obj in json_objs:
+        try:
+            row = numpy.array(filter_inputs(json_obj, sensor_def, converter_model), dtype=float)
+            if not numpy.all(numpy.isfinite(row)):
+                raise ValueError('Input contains NaN, infinity or a value too large: %s' % str(row))
+            rows.append(row)
+            results.append((None, None))
+        except Exception as e:
+            results.append((None, e))
+
+    if len(rows) == 0:
+        return results
+
+    values = iter(mlp_regressor.predict(numpy.array(rows, dtype=float)))
+    return [(next(values), None) if error is None else (value, error) for value, error in results]
+
+
+@batch_converter(ohm_to_ugm3_batch)
 def ohm_co_to_ugm3(input, json_obj, sensor_def, device=None):
     return ohm_to_ugm3(input, json_obj, sensor_def, device)
 
 
+@batch_converter(ohm_to_ugm3_batch)
 def ohm_no2_to_ugm3(input, json_obj, sensor_def, device=None):
     return ohm_to_ugm3(input, json_obj, sensor_def, device)
 
 
+@batch_converter(ohm_to_ugm3_batch)
 def ohm_o3_to_ugm3(input, json_obj, sensor_def, device=None):
     return ohm_to_ugm3(input, json_obj, sensor_def, device)
 
@@ -81,6 +121,12 @@ def ohm_no2_to_kohm(input, json_obj=None, sensor_def=None, device=None):
     return val
 
 
+def convert_temperature_column(values):
+    tempC = values / 1000.0 - 273.1
+    return numpy.where((values == 0) | (tempC > 100) | (tempC < -40), numpy.nan, tempC)
+
+
+@column_converter(convert_temperature_column)
 def convert_temperature(input, json_obj=None, sensor_def=None, device=None):
     if input == 0:
         return None
@@ -92,6 +138,12 @@ def convert_temperature(input, json_obj=None, sensor_def=None, device=None):
     return tempC
 
 
+def convert_barometer_column(values):
+    result = values / 100.0
+    return numpy.where(result > 1100.0, numpy.nan, result)
+
+
+@column_converter(convert_barometer_column)
 def convert_barometer(input, json_obj=None, sensor_def=None, device=None):
     result = float(input) / 100.0
     if result > 1100.0:
@@ -99,6 +151,12 @@ def convert_barometer(input, json_obj=None, sensor_def=None, device=None):
     return result
 
 
+def convert_humidity_column(values):
+    humPercent = values / 1000.0
+    return numpy.where(humPercent > 100, numpy.nan, humPercent)
+
+
+@column_converter(convert_humidity_column)
 def convert_humidity(input, json_obj=None, sensor_def=None, device=None):
     humPercent = float(input) / 1000.0
     if humPercent > 100:
@@ -80,6 +80,14 @@ class Vanilla(Device):
             pass
         return None
 
+    def get_device_state(self, device_ids):
+        # Last values of devices
+        device_ids = [str(device_id) for device_id in device_ids]
+        return dict((device_id, self.last_values[device_id]) for device_id in device_ids if device_id in self.last_values)
+
+    def set_device_state(self, state):
+        self.last_values.update(state)
+
     def set_last_value(self, device_id, name, value, val_dict):
         try:
             # Best effort
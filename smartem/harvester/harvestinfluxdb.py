@@ -1,3 +1,4 @@
+import os
 import time
 from datetime import datetime
 import json
@@ -7,6 +8,7 @@ from stetl.postgis import PostGIS
 from stetl.util import Util
 
 from smartem.influxdbinput import InfluxDbInput
+from smartem.harvester.progressindex import ProgressIndex
 
 log = Util.get_log("HarvesterInfluxDbInput")
 
@@ -24,12 +26,13 @@ class HarvesterInfluxDbInput(InfluxDbInput):
 
     Algorithm:
 
-        * fetch all Measurements (table names)
-        * for each Measurement:
+        * fetch all Measurements (table names) and their start/end times (concurrency queries at a time),
+          start times are cached in metadata_cache_file, end times are not queried when caught up
+        * for each Measurement (concurrency Measurements at a time):
         * if Measurement (name) is not in progress-table insert and set day,hour to 0
         * if in progress-table fetch entry (day, hour)
         * get timeseries (hours) available for that day
-        * fetch and store each, starting with the last hour previously stored
+        * fetch window_hours per query and store each hour, starting with the last hour previously stored
         * ignore timeseries for current day/hour, as the hour will not be yet filled (and Refiner may else already process)
         * stored entry: measurement, day, hour, json blob
         * finish: when all done or when max_proc_time_secs passed
@@ -92,6 +95,30 @@ class HarvesterInfluxDbInput(InfluxDbInput):
         """
         pass
 
+    @Config(ptype=int, default=1, required=False)
+    def window_hours(self):
+        """
+        Number of hours to fetch in one query per Measurement. Results are split into
+        a record per hour. Use e.g. 24 to catch up on a large backlog.
+
+        Required: False
+
+        Default: 1
+        """
+        pass
+
+    @Config(ptype=str, default=None, required=False)
+    def metadata_cache_file(self):
+        """
+        Optional JSON file to cache Measurement metadata (field name, start time) over runs,
+        avoiding expensive FIRST() queries. Delete the file when Measurements are recreated.
+
+        Required: False
+
+        Default: None
+        """
+        pass
+
     @Config(ptype=str, required=False, default='localhost')
     def pg_host(self):
         """
@@ -138,11 +165,12 @@ class HarvesterInfluxDbInput(InfluxDbInput):
         InfluxDbInput.__init__(self, configdict, section)
         self.current_time_secs = lambda: int(round(time.time()))
         self.start_time_secs = self.current_time_secs()
-        self.progress_query = "SELECT * from %s where device_id=" % self.progress_table
+        self.progress_index = None
         self.measurements_info = []
-        self.index_m = -1
-        self.query = "SELECT * FROM %s WHERE time >= %d AND time < %d + 1h"
+        self.query = "SELECT * FROM %s WHERE time >= %d AND time < %d + %dh"
         self.tracking_db = None
+        self.window_records = None
+        self.metadata = dict()
 
     def init(self):
         InfluxDbInput.init(self)
@@ -155,10 +183,12 @@ class HarvesterInfluxDbInput(InfluxDbInput):
                        }
         self.tracking_db = PostGIS(postgis_cfg)
         self.tracking_db.connect()
+        self.progress_index = ProgressIndex(self.tracking_db, self.progress_table)
+        self.progress_index.load()
 
         # One time: get all measurements and related info and store in structure
-        measurements = self.get_measurement_names()
-        for measurement in measurements:
+        measurements = []
+        for measurement in self.get_measurement_names():
             # Optional mapping from MEASUREMENT name to a device id
             # Otherwise device_is is Measurement name
             device_id = measurement
@@ -169,28 +199,26 @@ class HarvesterInfluxDbInput(InfluxDbInput):
 
                 device_id = self.meas_name_to_device_id[measurement]
 
-            date_start_s, start_ts = self.get_start_time(measurement)
-            date_end_s, end_ts = self.get_end_time(measurement)
-            start_ts = self.date_str_to_whole_hour_nanos(date_start_s)
-            end_ts *= NANOS_FACTOR
-
             # Shift time for current_ts from progress table if already in progress
             # otherwise use start time of measurement.
+            measurements.append((measurement, device_id, self.get_progress_ts(device_id)))
+
+        # Query metadata and start/end times concurrently
+        self.metadata = self.load_metadata()
+        times = self.map_concurrent(self.get_start_end_time,
+                                    [(measurement, progress_ts) for measurement, device_id, progress_ts in measurements])
+        for (measurement, device_id, progress_ts), (metadata, date_end_s, end_ts) in zip(measurements, times):
+            self.metadata[measurement] = metadata
+            date_start_s = metadata['date_start_s']
+            start_ts = None
+            if date_start_s:
+                start_ts = self.date_str_to_whole_hour_nanos(date_start_s)
+            end_ts *= NANOS_FACTOR
+
             current_ts = start_ts
-            row_count = self.tracking_db.execute(self.progress_query + device_id)
-            if row_count > 0:
+            if progress_ts is not None:
                 # Already in progress
-                progress_rec = self.tracking_db.cursor.fetchone()
-                ymd_last = str(progress_rec[4])
-                year_last = ymd_last[0:4]
-                month_last = ymd_last[4:6]
-                day_last = ymd_last[6:]
-                hour_last = progress_rec[5]
-                # e.g. 2017-11-17T11:00:00.411Z
-                date_str = '%s-%s-%sT%d:00:00.000Z' % (year_last, month_last, day_last, hour_last-1)
-                current_ts = self.date_str_to_whole_hour_nanos(date_str)
-                # skip to next hour
-                # current_ts += (3600 * NANOS_FACTOR)
+                current_ts = progress_ts
 
             # Store all info per device (measurement table) in list of dict
             self.measurements_info.append({
@@ -203,8 +231,81 @@ class HarvesterInfluxDbInput(InfluxDbInput):
                 'device_id': device_id
             })
 
+        self.save_metadata()
         print ("measurements_info: %s" % str(self.measurements_info))
 
+    def get_progress_ts(self, device_id):
+        """
+        Get harvesting progress of device from progress table.
+        :param device_id:
+        :return: timestamp nanos of last hour harvested or None if not in progress:
+        """
+        progress = self.progress_index.get(device_id)
+        if progress is None:
+            return None
+
+        ymd_last = str(progress[0])
+        year_last = ymd_last[0:4]
+        month_last = ymd_last[4:6]
+        day_last = ymd_last[6:]
+        hour_last = progress[1]
+        # e.g. 2017-11-17T11:00:00.411Z
+        date_str = '%s-%s-%sT%d:00:00.000Z' % (year_last, month_last, day_last, hour_last-1)
+        # skip to next hour
+        # current_ts += (3600 * NANOS_FACTOR)
+        return self.date_str_to_whole_hour_nanos(date_str)
+
+    def get_start_end_time(self, measurement_progress):
+        """
+        Get metadata (field name, start date/time) and end date/time of Measurement.
+        Metadata is taken from the cache if present. Start time is only queried (FIRST) when
+        not in progress, end time (LAST) only when not caught up with current time.
+        :param measurement_progress: tuple of Measurement name, progress timestamp nanos or None
+        :return tuple of: metadata dict, endtime as UTC string, end timestamp in secs:
+        """
+        measurement, progress_ts = measurement_progress
+        metadata = self.metadata.get(measurement)
+        if metadata is None:
+            metadata = {'field_name': self.get_field_names(measurement)[0], 'date_start_s': None}
+
+        if progress_ts is None and not metadata['date_start_s']:
+            metadata = dict(metadata)
+            metadata['date_start_s'], start_ts = self.get_start_time(measurement, metadata['field_name'])
+
+        now_secs = self.current_time_secs()
+        if progress_ts is not None and progress_ts / NANOS_FACTOR + 3600 * self.window_hours >= now_secs:
+            # Caught up: next window reaches current time, harvest upto now
+            date_end_s = datetime.utcfromtimestamp(now_secs).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            return metadata, date_end_s, now_secs
+
+        date_end_s, end_ts = self.get_end_time(measurement, metadata['field_name'])
+        return metadata, date_end_s, end_ts
+
+    def load_metadata(self):
+        # Cached metadata per Measurement from metadata_cache_file
+        metadata = dict()
+        if self.metadata_cache_file and os.path.exists(self.metadata_cache_file):
+            try:
+                with open(self.metadata_cache_file) as f:
+                    metadata = json.load(f)
+                log.info('Loaded metadata for %d measurements from %s' % (len(metadata), self.metadata_cache_file))
+            except Exception as e:
+                log.warn('Cannot read metadata cache %s: %s' % (self.metadata_cache_file, str(e)))
+
+        return metadata
+
+    def save_metadata(self):
+        if not self.metadata_cache_file:
+            return
+
+        # Atomic replace
+        try:
+            with open(self.metadata_cache_file + '.tmp', 'w') as f:
+                json.dump(self.metadata, f, indent=2, sort_keys=True)
+            os.rename(self.metadata_cache_file + '.tmp', self.metadata_cache_file)
+        except Exception as e:
+            log.warn('Cannot write metadata cache %s: %s' % (self.metadata_cache_file, str(e)))
+
     def all_done(self):
         return len(self.measurements_info) == 0
 
@@ -213,13 +314,16 @@ class HarvesterInfluxDbInput(InfluxDbInput):
             return True
         return False
 
-    def next_measurement_info(self):
-        self.index_m += 1
-        return self.measurements_info[self.index_m % len(self.measurements_info)]
+    def next_measurement_infos(self):
+        # Next (up to) concurrency measurements, round-robin: move to end of list
+        count = min(self.concurrency, len(self.measurements_info))
+        measurement_infos = self.measurements_info[:count]
+        self.measurements_info = self.measurements_info[count:] + measurement_infos
+        return measurement_infos
 
-    def del_measurement_info(self):
-        if not self.all_done():
-            del self.measurements_info[self.index_m % len(self.measurements_info)]
+    def del_measurement_info(self, measurement_info):
+        if measurement_info in self.measurements_info:
+            self.measurements_info.remove(measurement_info)
 
     def before_invoke(self, packet):
         if self.has_expired() or self.all_done():
@@ -248,44 +352,72 @@ class HarvesterInfluxDbInput(InfluxDbInput):
         return timestamp
 
     def read(self, packet):
-        measurement_info = self.next_measurement_info()
-
-        current_ts_nanos = measurement_info['current_ts']
-        current_ts_secs = current_ts_nanos / NANOS_FACTOR
-        query = self.query % (measurement_info['name'], current_ts_nanos, current_ts_nanos)
-        data = self.query_db(query)
-
-        if len(data) >= 1:
-            d = datetime.utcfromtimestamp(current_ts_secs)
-            day = d.strftime('%Y%m%d')
-            hour = str(d.hour + 1).zfill(2)
-
-            # DEBUG: store only first and last of hour-series
-            data_first = {
-                'time': data[0]['time']
-            }
-            data_last = {
-                'time': data[len(data) - 1]['time']
-            }
-            # data_o = data
-            # data = [data_first, data_last]
-            # for i in range(0,4):
-            #     data.append(data_o[i])
-            record = self.format_data(measurement_info['device_id'], day, hour, data)
-            packet.data = None
+        # Records per hour from the current windows, next windows (Measurements) when exhausted
+        if self.window_records is None:
+            self.window_records = self.read_windows(self.next_measurement_infos())
+
+        packet.data = next(self.window_records, None)
+        if packet.data is None:
+            self.window_records = None
+
+        return packet
+
+    def read_windows(self, measurement_infos):
+        """
+        Generator of complete hour records for window_hours from current time of measurements,
+        in order of measurements. Multiple measurements are queried concurrently.
+        Shifts the current time of each measurement when done.
+        """
+        queries = []
+        for measurement_info in measurement_infos:
+            current_ts_nanos = measurement_info['current_ts']
+            queries.append(self.query % (measurement_info['name'], current_ts_nanos, current_ts_nanos, self.window_hours))
+
+        if len(queries) == 1:
+            # Stream single window
+            windows = [self.query_db_iter(queries[0])]
+        else:
+            windows = self.map_concurrent(lambda query: list(self.query_db_iter(query)), queries)
+
+        for measurement_info, points in zip(measurement_infos, windows):
+            for record in self.split_hours(measurement_info['device_id'], points):
+                yield record
+
+            self.shift_window(measurement_info)
+
+    def split_hours(self, device_id, points):
+        # Points are in time order: split per hour on UTC time string, e.g. '2017-11-17T11'
+        data = []
+        for point in points:
+            if len(data) > 0 and point['time'][:13] != data[0]['time'][:13]:
+                record = self.format_hour(device_id, data)
+                if record['complete']:
+                    yield record
+                data = []
+
+            data.append(point)
+
+        if len(data) > 0:
+            record = self.format_hour(device_id, data)
             if record['complete']:
-                packet.data = record
+                yield record
 
-        # Shift time an hour for this device
-        current_ts_nanos = (current_ts_secs + 3600) * NANOS_FACTOR
+    def shift_window(self, measurement_info):
+        # Shift time window_hours for this device
+        current_ts_secs = measurement_info['current_ts'] / NANOS_FACTOR
+        current_ts_nanos = (current_ts_secs + 3600 * self.window_hours) * NANOS_FACTOR
         if current_ts_nanos > measurement_info['end_ts']:
             # all done for current measurement/device
-            self.del_measurement_info()
+            self.del_measurement_info(measurement_info)
         else:
-            # Shift to next hour for this measurement
+            # Shift to next window for this measurement
             measurement_info['current_ts'] = current_ts_nanos
 
-        return packet
+    def format_hour(self, device_id, data):
+        d = datetime.strptime(data[0]['time'][:13], '%Y-%m-%dT%H')
+        day = d.strftime('%Y%m%d')
+        hour = str(d.hour + 1).zfill(2)
+        return self.format_data(device_id, day, hour, data)
 
     # Create a data record for timeseries of current device/day/hour
     def format_data(self, device_id, day, hour, data):
@@ -9,6 +9,11 @@ from smartem.influxdbinput import InfluxDbInput
 log = Util.get_log("HarvesterLastInfluxDbInput")
 
 
+def escape_regex(value):
+    # Escape regex special chars and slash (regex delimiter) for InfluxQL regex
+    return ''.join(['\\' + char if char in '\\.^$*+?()[]{}|/' else char for char in value])
+
+
 class HarvesterLastInfluxDbInput(InfluxDbInput):
     """
     InfluxDB TimeSeries Last Values fetcher/formatter.
@@ -19,10 +24,14 @@ class HarvesterLastInfluxDbInput(InfluxDbInput):
 
         * fetch all Measurements (table names)
         * for each Measurement:
-        * query all sample records for last 2 hours sorted by time descendent
+        * query all sample records for last 2 hours sorted by time descendent (concurrency Measurements at a time)
         * get last record for each record (field 'name' is)
         * format to record that Refiner understands
 
+    With single_query the last value per sensor name of all Measurements is fetched
+    in a single LAST() query grouped by name. Points then only have the time, name and
+    single_query_fields columns, not all fields as in the query per Measurement.
+
     """
 
     @Config(ptype=str, default=None, required=True)
@@ -81,12 +90,38 @@ class HarvesterLastInfluxDbInput(InfluxDbInput):
         """
         pass
 
+    @Config(ptype=bool, default=False, required=False)
+    def single_query(self):
+        """
+        Query last values of all Measurements in one query: LAST() of the first field
+        in single_query_fields over a Measurement regex, grouped by (tag) name.
+
+        Required: False
+
+        Default: False
+        """
+        pass
+
+    @Config(ptype=str, default='sampleEvaluatedVal', required=False)
+    def single_query_fields(self):
+        """
+        Comma-separated fields for single_query: LAST() is taken from the first field,
+        other fields are returned from the same point. Only these fields (with time and name)
+        are in the timeseries, list all fields needed downstream.
+
+        Required: False
+
+        Default: sampleEvaluatedVal
+        """
+        pass
+
     def __init__(self, configdict, section, produces=FORMAT.record):
         InfluxDbInput.__init__(self, configdict, section, produces)
         self.current_time_secs = lambda: int(round(time.time()))
         self.start_time_secs = self.current_time_secs()
         self.measurements_info = []
         self.index_m = -1
+        self.prefetched = dict()
         self.query = "SELECT * FROM %s WHERE time >= now()-%s and time <= now() ORDER BY time DESC LIMIT %d"
 
     def init(self):
@@ -139,9 +174,59 @@ class HarvesterLastInfluxDbInput(InfluxDbInput):
             packet.set_end_of_stream()
             return False
 
+    def prefetch(self, measurement_info):
+        if self.single_query:
+            # All measurements in one query
+            last_values = self.query_last_values()
+            for info in self.measurements_info:
+                self.prefetched[info['name']] = last_values.get(info['name'], [])
+            return
+
+        # Query this and next measurements not yet fetched, concurrently
+        index = self.measurements_info.index(measurement_info)
+        todo = self.measurements_info[index:] + self.measurements_info[:index]
+        todo = [info for info in todo if info['name'] not in self.prefetched][:self.concurrency]
+        results = self.map_concurrent(lambda info: self.query_db(info['query']), todo)
+        for info, data in zip(todo, results):
+            self.prefetched[info['name']] = data
+
+    def query_last_values(self):
+        """
+        Query last value per sensor name for all Measurements in one query.
+        :return dict of Measurement name to list of points (newest first):
+        """
+        names = '|'.join([escape_regex(info['name']) for info in self.measurements_info])
+        fields = [field.strip() for field in self.single_query_fields.split(',')]
+        select = ['LAST("%s") AS "%s"' % (fields[0], fields[0])] + ['"%s"' % field for field in fields[1:]]
+        query = 'SELECT %s FROM /^(%s)$/ WHERE time >= now()-%s GROUP BY "name"' % \
+                (','.join(select), names, self.query_since)
+
+        log.info("Querying database: %s", query)
+        result = self.get_client().query(query)
+
+        # Demultiplex series per (measurement, name) into points per measurement
+        last_values = dict()
+        for (measurement, tags), points in result.items():
+            if measurement not in last_values:
+                last_values[measurement] = list()
+
+            # Tags (name) are per series, not in points
+            for point in points:
+                if tags:
+                    point.update(tags)
+                last_values[measurement].append(point)
+
+        for points in last_values.values():
+            points.sort(key=lambda point: point['time'], reverse=True)
+
+        log.info("Received last values for %d measurements" % len(last_values))
+        return last_values
+
     def read(self, packet):
         measurement_info = self.next_measurement_info()
-        data = self.query_db(measurement_info['query'])
+        if measurement_info['name'] not in self.prefetched:
+            self.prefetch(measurement_info)
+        data = self.prefetched.pop(measurement_info['name'])
 
         if len(data) >= 1:
             # Having data: scrub for only the last unique
@@ -152,6 +237,9 @@ class HarvesterLastInfluxDbInput(InfluxDbInput):
                     last_name_vals[d['name']] = d
 
             last_vals = list(last_name_vals.values())
+            if len(last_vals) == 0:
+                log.warn('No sensor name in points of %s, skipping' % measurement_info['name'])
+                return packet
 
             packet.data = self.format_data(int(measurement_info['device_id']), last_vals)
 
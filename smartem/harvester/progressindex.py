@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# ProgressIndex: in-memory index of the harvester progress table.
+#
+# Author: Just van den Broecke
+
+from stetl.util import Util
+
+log = Util.get_log("ProgressIndex")
+
+
+class ProgressIndex:
+    """
+    Harvesting progress per device: device_id to (day, hour) of last harvested hour.
+    The progress table (updated by a TRIGGER on inserts) is read once in a single query.
+    Devices marked as advanced are re-read from the table on their next lookup.
+    """
+
+    def __init__(self, db, progress_table):
+        self.db = db
+        self.progress_table = progress_table
+        self.progress = dict()
+        self.advanced = set()
+
+    def load(self):
+        self.db.execute('SELECT device_id, day, hour FROM %s' % self.progress_table)
+
+        self.progress = dict()
+        self.advanced = set()
+        for device_id, day, hour in self.db.cursor.fetchall():
+            self.progress[str(device_id)] = (day, hour)
+
+        log.info('Loaded progress of %d devices from %s' % (len(self.progress), self.progress_table))
+
+    def get(self, device_id):
+        """
+        Get progress of device.
+        :param device_id:
+        :return: tuple (day, hour) or None if device not in progress:
+        """
+        device_id = str(device_id)
+        if device_id in self.advanced:
+            self.refresh(device_id)
+
+        return self.progress.get(device_id)
+
+    def set_advanced(self, device_id):
+        # Progress of device changed (records written): re-read on next get()
+        self.advanced.add(str(device_id))
+
+    def refresh(self, device_id):
+        device_id = str(device_id)
+        self.advanced.discard(device_id)
+        row_count = self.db.execute('SELECT day, hour FROM %s WHERE device_id=%s' % (self.progress_table, device_id))
+        if row_count > 0:
+            day, hour = self.db.cursor.fetchone()
+            self.progress[device_id] = (day, hour)
@@ -6,6 +6,10 @@
 
 import time
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+from urllib2 import Request
+
+import requests
 from stetl.component import Config
 from stetl.util import Util
 from stetl.packet import FORMAT
@@ -18,6 +22,10 @@ log = Util.get_log("RawSensorAPI")
 class RawSensorLastInput(RawSensorAPIInput):
     """
     Raw Sensor REST API (CityGIS) to fetch last values for all devices.
+
+    With concurrency > 1 the last values of all devices are polled concurrently over
+    a pool of keep-alive connections, each with timeout. Failing devices are skipped.
+    Records are output in order of devices, as soon as available.
     """
 
     @Config(ptype=list, default=[], required=True)
@@ -31,22 +39,89 @@ class RawSensorLastInput(RawSensorAPIInput):
         """
         pass
 
+    @Config(ptype=float, default=10.0, required=False)
+    def timeout(self):
+        """
+        Timeout in seconds for fetching last values of a device when polling concurrently.
+
+        Required: False
+
+        Default: 10.0
+        """
+        pass
+
     def __init__(self, configdict, section, produces=FORMAT.record):
         RawSensorAPIInput.__init__(self, configdict, section, produces)
         self.models = None
 
+        # Concurrent polling: iterator of (device_id, data) in order of devices
+        self.pool = None
+        self.session = None
+        self.polled = None
+        self.polled_data = None
 
     def init(self):
         # One time: get all device ids
         self.fetch_devices()
 
+        if self.concurrency > 1:
+            self.start_polling()
+
+    def exit(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.session.close()
+
+        RawSensorAPIInput.exit(self)
+
+    def start_polling(self):
+        # Session with connection pool for all threads, same authorization as read_from_url()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if self.auth:
+            request = Request(self.base_url)
+            self.add_authorization(request)
+            self.session.headers.update(request.headers)
+
+        self.pool = ThreadPool(self.concurrency)
+        self.polled = self.pool.imap(self.poll_device, self.device_ids)
+        self.pool.close()
+        log.info('Polling %d devices with %d threads' % (len(self.device_ids), self.concurrency))
+
+    def poll_device(self, device_id):
+        """
+        Fetch last values of device (in pool thread).
+        :param device_id:
+        :return: tuple device_id, data or None on error:
+        """
+        url = self.base_url + '/devices/%d/last' % device_id
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return device_id, response.content
+        except Exception as e:
+            log.error('Error fetching %s: e=%s, skip device...' % (url, str(e)))
+
+        return device_id, None
+
     def before_invoke(self, packet):
         """
         Called just before Component invoke.
         """
 
-        # The base method read() will fetch self.url until it is set to None
-        self.device_id, self.device_ids_idx = self.next_entry(self.device_ids, self.device_ids_idx)
+        if self.pool is not None:
+            # Next polled device, see read()
+            self.device_id, self.polled_data = next(self.polled, (-1, None))
+        else:
+            # The base method read() will fetch self.url until it is set to None
+            self.device_id, self.device_ids_idx = self.next_entry(self.device_ids, self.device_ids_idx)
 
         # Stop when all devices done
         if self.device_id < 0:
@@ -65,6 +140,18 @@ class RawSensorLastInput(RawSensorAPIInput):
 
         return True
 
+    def read(self, packet):
+        if self.pool is None:
+            return RawSensorAPIInput.read(self, packet)
+
+        try:
+            packet.data = self.format_data(self.polled_data)
+        except Exception as e:
+            log.error('Error formatting last values device %d: e=%s, skip device...' % (self.device_id, str(e)))
+            packet.data = None
+
+        return packet
+
     def read_from_url(self, url, parameters=None):
         """
         Read the data from the URL, override to catch Exception without exiting process.
@@ -4,15 +4,22 @@
 #
 # Author:Just van den Broecke
 
+import calendar
 import time
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Full
 from stetl.component import Config
 from stetl.util import Util
 from stetl.packet import FORMAT
 from stetl.postgis import PostGIS
 from smartem.rawsensorapi import RawSensorAPIInput
+from smartem.harvester.progressindex import ProgressIndex
 
 log = Util.get_log("RawSensorTimeseriesInput")
 
+# Max records buffered per fetching thread when fetching concurrently
+DEVICE_BUFFER = 10
+
 
 class RawSensorTimeseriesInput(RawSensorAPIInput):
     """
@@ -33,6 +40,15 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
     - ignore timeseries for current day/hour, as the hour will not be yet filled (and Refiner may else already process)
     - stored entry: device_id, day, hour, last_flag, json blob
     - finish: when all done or when max_proc_time_secs passed
+
+    With concurrency > 1 devices are fetched concurrently by a pool of threads, each device
+    (days, hours, hour timeseries) by a single thread, such that hours are fetched in order per device.
+    Records are output as fetched, interleaved over devices: in order of hours per device,
+    but not in order of devices.
+
+    With schedule = lag devices are ordered by their lag (backlog hours from the progress table upto now),
+    largest first, instead of random shuffling. Without concurrency hours of devices are fetched interleaved
+    by smooth weighted round-robin, weighted by lag. The lag per device is logged at exit.
     """
 
     @Config(ptype=int, default=None, required=True)
@@ -57,6 +73,18 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
         """
         pass
 
+    @Config(ptype=str, default='shuffle', required=False)
+    def schedule(self):
+        """
+        Order of harvesting devices: 'shuffle' (random order) or 'lag' (largest backlog first,
+        weighted round-robin over devices).
+
+        Required: False
+
+        Default: shuffle
+        """
+        pass
+
     def __init__(self, configdict, section, produces=FORMAT.record_array):
         RawSensorAPIInput.__init__(self, configdict, section, produces)
 
@@ -77,18 +105,206 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
         self.hour_last = -1
         self.db = None
 
-        self.progress_query = "SELECT * from %s where device_id=" % self.progress_table
+        # Concurrent fetching: pool and record Queue shared by all devices,
+        # None is put when a device is done
+        self.pool = None
+        self.records = None
+        self.devices_done = 0
+        self.stopping = False
+
+        # Lag scheduling: lag (hours) at start and hours harvested per device,
+        # with smooth weighted round-robin state per device
+        self.lags = dict()
+        self.harvested = dict()
+        self.scheduled = None
+
+        self.progress_index = None
 
     def init(self):
         self.db = PostGIS(self.cfg.get_dict())
         self.db.connect()
 
+        # One time: get progress of all devices
+        self.progress_index = ProgressIndex(self.db, self.progress_table)
+        self.progress_index.load()
+
         # One time: get all device ids
         self.fetch_devices()
 
+        # Devices not yet in progress: full history, take largest lag (at least a year)
+        self.lags = dict([(device_id, self.get_lag_hours(device_id)) for device_id in self.device_ids])
+        max_lag = max([lag for lag in self.lags.values() if lag is not None] + [365 * 24])
+        for device_id in self.lags:
+            if self.lags[device_id] is None:
+                self.lags[device_id] = max_lag
+
+        if self.schedule == 'lag':
+            # Largest backlog first
+            self.device_ids.sort(key=lambda device_id: self.lags[device_id], reverse=True)
+            log.info('Devices by lag: %s' % str(self.device_ids))
+
+        if self.concurrency > 1:
+            self.start_fetching()
+        elif self.schedule == 'lag':
+            self.start_scheduling()
+
         # Pick a first device id
         # self.device_id, self.device_ids_idx = self.next_entry(self.device_ids, self.device_ids_idx)
 
+    def exit(self):
+        if self.pool is not None:
+            # Stop fetching threads
+            self.stopping = True
+            self.pool.join()
+            self.pool = None
+
+        # Lag summary
+        for device_id in sorted(self.lags, key=lambda device_id: self.lags[device_id], reverse=True):
+            log.info('Device %d: lag %d hours, harvested %d hours' %
+                     (device_id, self.lags[device_id], self.harvested.get(device_id, 0)))
+        log.info('Total lag %d hours, harvested %d hours' % (sum(self.lags.values()), sum(self.harvested.values())))
+
+        RawSensorAPIInput.exit(self)
+
+    def get_lag_hours(self, device_id):
+        """
+        Get lag of device: hours from last harvested hour upto now.
+        :param device_id:
+        :return: lag in hours, None if device not in progress:
+        """
+        progress = self.progress_index.get(device_id)
+        if progress is None:
+            return None
+
+        day, hour = progress
+        last_secs = calendar.timegm(time.strptime(str(day), '%Y%m%d')) + hour * 3600
+        return max(0, (self.current_time_secs() - last_secs) // 3600)
+
+    def start_scheduling(self):
+        # Lag scheduling: a record generator per device, weight is lag
+        self.scheduled = list()
+        for device_id in self.device_ids:
+            day_last, hour_last = self.get_progress(device_id)
+            self.scheduled.append({
+                'device_id': device_id,
+                'records': self.iter_device_records(device_id, day_last, hour_last),
+                'weight': max(1, self.lags[device_id]),
+                'current': 0
+            })
+
+    def next_scheduled_record(self):
+        # Next record by smooth weighted round-robin over devices (as in nginx), None if all done
+        while len(self.scheduled) > 0:
+            total = 0
+            entry = None
+            for candidate in self.scheduled:
+                candidate['current'] += candidate['weight']
+                total += candidate['weight']
+                if entry is None or candidate['current'] > entry['current']:
+                    entry = candidate
+            entry['current'] -= total
+
+            try:
+                record = next(entry['records'], None)
+            except Exception as e:
+                log.error('Error fetching device %d: %s' % (entry['device_id'], str(e)))
+                record = None
+
+            if record is not None:
+                return record
+
+            # All done for device
+            self.scheduled.remove(entry)
+
+        return None
+
+    def start_fetching(self):
+        # Concurrent fetching: a task per device, started in order of device ids
+        self.pool = ThreadPool(self.concurrency)
+        self.records = Queue(DEVICE_BUFFER * self.concurrency)
+        self.devices_done = 0
+        for device_id in self.device_ids:
+            day_last, hour_last = self.get_progress(device_id)
+            self.pool.apply_async(self.fetch_device, (device_id, day_last, hour_last))
+
+        self.pool.close()
+        log.info('Fetching %d devices with %d threads' % (len(self.device_ids), self.concurrency))
+
+    def fetch_device(self, device_id, day_last, hour_last):
+        """
+        Fetch thread: put records for all hours after day_last/hour_last of device in
+        the shared records Queue, in order, then None.
+        """
+        try:
+            for record in self.iter_device_records(device_id, day_last, hour_last):
+                if not self.put_record(record):
+                    return
+        except Exception as e:
+            log.error('Error fetching device %d: %s' % (device_id, str(e)))
+        finally:
+            self.put_record(None)
+
+    def iter_device_records(self, device_id, day_last, hour_last):
+        """
+        Generator of records for all hours after day_last/hour_last of device, in order.
+        Stops before fetching any listing or hour when stopping or expired.
+        """
+        if self.stopping or self.has_expired():
+            return
+
+        for day in self.get_days(device_id, day_last, hour_last):
+            if self.stopping or self.has_expired():
+                return
+
+            for hour in self.get_hours(device_id, day, day_last, hour_last):
+                # Skip harvesting the current hour as it will not yet be complete
+                current_day, current_hour = self.get_current_day_hour()
+                if day == current_day and hour - 1 >= current_hour:
+                    log.info('Skip device-day-hour: %d-%d-%d (still sampling current hour %d)' % (device_id, day, hour, current_hour))
+                    continue
+
+                if self.stopping or self.has_expired():
+                    return
+
+                url = self.base_url + '/devices/%d/timeseries/%d/%d' % (device_id, day, hour)
+                data = self.read_from_url(url)
+                yield self.create_record(device_id, day, hour, data)
+
+    def put_record(self, record):
+        # Wait for room in Queue unless stopping
+        while not self.stopping:
+            try:
+                self.records.put(record, True, 1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def next_record(self):
+        # Next record fetched concurrently from any device (in order per device), None if all done
+        while self.devices_done < len(self.device_ids):
+            record = self.records.get()
+            if record is not None:
+                return record
+
+            self.devices_done += 1
+
+        return None
+
+    def read(self, packet):
+        if self.pool is not None:
+            packet.data = self.next_record()
+        elif self.scheduled is not None:
+            packet.data = self.next_scheduled_record()
+        else:
+            return RawSensorAPIInput.read(self, packet)
+
+        if packet.data is None:
+            log.info('Processing all devices done')
+            packet.set_end_of_stream()
+
+        return packet
+
     def all_done(self):
         if self.device_ids_idx < 0 and self.days_idx < 0 and self.hours_idx < 0:
             return True
@@ -107,7 +323,29 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
         if self.device_id < 0:
             return
 
-        ts_days_url = self.base_url + '/devices/%d/timeseries' % self.device_id
+        self.day_last, self.hour_last = self.get_progress(self.device_id)
+        self.days = self.get_days(self.device_id, self.day_last, self.hour_last)
+        if len(self.days) > 0:
+            self.days_idx = 0
+
+    def get_progress(self, device_id):
+        """
+        Get last harvested day and hour of device from progress index.
+        :param device_id:
+        :return: tuple day_last, hour_last, -1, -1 if not in progress:
+        """
+        progress = self.progress_index.get(device_id)
+        if progress is None:
+            return -1, -1
+
+        return progress
+
+    def get_days(self, device_id, day_last, hour_last):
+        """
+        Fetch timeseries days of device from day_last.
+        :return: list of days (int) still to be processed:
+        """
+        ts_days_url = self.base_url + '/devices/%d/timeseries' % device_id
         log.info('Init: fetching timeseries days list from URL: "%s" ...' % ts_days_url)
 
         json_str = self.read_from_url(ts_days_url)
@@ -117,25 +355,16 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
         # cut of last
         days_raw = json_obj['days']
 
-        row_count = self.db.execute(self.progress_query + str(self.device_id))
-        self.day_last = -1
-        self.hour_last = -1
-        if row_count > 0:
-            progress_rec = self.db.cursor.fetchone()
-            self.day_last = progress_rec[4]
-            self.hour_last = progress_rec[5]
-
         # Take a subset of all days: namely those still to be processed
         # Always include the last/current day as it may not be complete
+        days = []
         for d in days_raw:
             day = int(d.split('/')[-1])
-            if day >= self.day_last:
-                self.days.append(day)
-
-        if len(self.days) > 0:
-            self.days_idx = 0
+            if day >= day_last:
+                days.append(day)
 
-        log.info('Device: %d, raw days: %d, days=%d, day_last=%d, hour_last=%d' % (self.device_id, len(days_raw), len(self.days), self.day_last, self.hour_last))
+        log.info('Device: %d, raw days: %d, days=%d, day_last=%d, hour_last=%d' % (device_id, len(days_raw), len(days), day_last, hour_last))
+        return days
 
     def fetch_ts_hours(self):
         self.hours_idx = -1
@@ -170,7 +399,16 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
         # 2016-10-30 12:29:11,534 RawSensorAPI INFO self.url = http://whale.citygis.nl/sensors/v1/devices/71/timeseries/20161030/11 cur_day=20161030 cur_hour=11
         # 2016-10-30 12:29:13,177 RawSensorAPI INFO Skipped device-day-hour: 71-20161030-12 (it is still sampling current hour 11)
 
-        ts_hours_url = self.base_url + '/devices/%d/timeseries/%d' % (self.device_id, self.day)
+        self.hours = self.get_hours(self.device_id, self.day, self.day_last, self.hour_last)
+        if len(self.hours) > 0:
+            self.hours_idx = 0
+
+    def get_hours(self, device_id, day, day_last, hour_last):
+        """
+        Fetch timeseries hours of device for day.
+        :return: list of hours (int) after day_last/hour_last:
+        """
+        ts_hours_url = self.base_url + '/devices/%d/timeseries/%d' % (device_id, day)
         log.info('Init: fetching timeseries hours list from URL: "%s" ...' % ts_hours_url)
         # Set the next "last values" URL for device and increment to next
         json_str = self.read_from_url(ts_hours_url)
@@ -179,18 +417,18 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
 
         # Get the current day and hour in UTC
         current_day, current_hour = self.get_current_day_hour()
+        hours = []
         for h in hours_all:
             hour = int(h)
-            if self.day > self.day_last or (self.day == self.day_last and hour > self.hour_last):
-                if self.day_last == current_day and hour - 1 >= current_hour:
+            if day > day_last or (day == day_last and hour > hour_last):
+                if day_last == current_day and hour - 1 >= current_hour:
                     # never append the last hour of today
-                    log.info('Skip current hour from %d to %d for device %d on day %d' % (hour, hour, self.device_id, self.day))
+                    log.info('Skip current hour from %d to %d for device %d on day %d' % (hour, hour, device_id, day))
                 else:
-                    self.hours.append(hour)
+                    hours.append(hour)
 
-        if len(self.hours) > 0:
-            self.hours_idx = 0
-        log.info('processable hours for device %d day %d: %s' % (self.device_id, self.day, str(self.hours)))
+        log.info('processable hours for device %d day %d: %s' % (device_id, day, str(hours)))
+        return hours
 
     def next_day(self):
         # All days for current device done? Try next device
@@ -237,6 +475,14 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
         Called just before Component invoke.
         """
 
+        if self.pool is not None or self.scheduled is not None:
+            # Records fetched concurrently or scheduled, see read()
+            if self.has_expired():
+                log.info('Processing halted: expired')
+                packet.set_end_of_stream()
+                return False
+            return True
+
         # Try to fill in: should point to next hour timeseries REST URL
         self.url = None
 
@@ -279,6 +525,12 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
 
     # Create a data record for timeseries of current device/day/hour
     def format_data(self, data):
+        # Progress of device will be advanced by written record
+        self.progress_index.set_advanced(self.device_id)
+        return self.create_record(self.device_id, self.day, self.hour, data)
+
+    # Create a data record for timeseries of device/day/hour
+    def create_record(self, device_id, day, hour, data):
 
         #
         # -- Map this to
@@ -299,12 +551,13 @@ class RawSensorTimeseriesInput(RawSensorAPIInput):
 
         # Create record with JSON text blob with metadata
         record = dict()
-        record['unique_id'] = '%d-%d-%d' % (self.device_id, self.day, self.hour)
+        record['unique_id'] = '%d-%d-%d' % (device_id, day, hour)
 
         # Timestamp of sample
-        record['device_id'] = self.device_id
-        record['day'] = self.day
-        record['hour'] = self.hour
+        record['device_id'] = device_id
+        record['day'] = day
+        record['hour'] = hour
+        self.harvested[device_id] = self.harvested.get(device_id, 0) + 1
 
         # Assume hour is "complete" (5.2.18: skip complete = False entries for now).
         record['complete'] = True
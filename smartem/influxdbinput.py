@@ -1,11 +1,16 @@
+import json
+import threading
 import time
 from calendar import timegm
+from multiprocessing.pool import ThreadPool
+
 from stetl.component import Config
 from stetl.input import Input
 from stetl.packet import FORMAT
 from stetl.util import Util
 
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
 
 log = Util.get_log("InfluxDbInput")
 
@@ -64,15 +69,71 @@ class InfluxDbInput(Input):
         Required: True
         """
 
+    @Config(ptype=int, required=False, default=0)
+    def chunk_size(self):
+        """
+        Number of points per chunk when streaming query results (query_db_iter):
+        the server sends the result in chunks which are parsed one at a time, such that
+        memory scales with chunk size, not query size. 0 means no streaming, read full results.
+
+        Default: 0
+        """
+        pass
+
+    @Config(ptype=int, required=False, default=1)
+    def concurrency(self):
+        """
+        Max number of concurrent queries (threads), e.g. for querying multiple Measurements.
+
+        Default: 1
+        """
+        pass
+
     def __init__(self, configdict, section, produces=FORMAT.record_array):
         Input.__init__(self, configdict, section, produces)
         self.client = None
+        self.thread_clients = threading.local()
+        self.pool = None
 
     def init(self):
         log.info("Setting up connection to influxdb %s:%s, database=%s" %
                  (self.host, self.port, self.database))
         self.client = InfluxDBClient(self.host, self.port, self.user,
                                      self.password, self.database)
+        self.thread_clients.client = self.client
+
+    def exit(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        Input.exit(self)
+
+    def get_client(self):
+        # Client per thread: its requests Session is not thread-safe
+        client = getattr(self.thread_clients, 'client', None)
+        if client is None:
+            client = InfluxDBClient(self.host, self.port, self.user,
+                                    self.password, self.database)
+            self.thread_clients.client = client
+        return client
+
+    def map_concurrent(self, func, items):
+        """
+        Apply func to each item with up to concurrency threads.
+        :param func: function of one item
+        :param items: list of items
+        :return list of results, in order of items:
+        """
+        if self.concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        # One pool for all calls such that the threads keep their clients
+        if self.pool is None:
+            self.pool = ThreadPool(self.concurrency)
+
+        return self.pool.map(func, items)
 
     def date_str_to_ts_nanos(self, date_str):
         # See https://aboutsimon.com/blog/2013/06/06/Datetime-hell-Time-zone-aware-to-UNIX-timestamp.html
@@ -102,31 +163,37 @@ class InfluxDbInput(Input):
         meas = self.query_db('SHOW MEASUREMENTS')
         return [v['name'] for v in meas]
 
-    def get_start_time(self, measurement):
+    def get_start_time(self, measurement, field_name=None):
         """
         Get start date/time of Measurement.
         :param measurement: 
+        :param field_name: field to query, default first field of Measurement
         :return tuple of: starttime as UTC string, timestamp in nanos: 
         """
+        if field_name is None:
+            field_name = self.get_field_names(measurement)[0]
         date_str = self.query_db('SELECT FIRST(%s), time FROM %s' %
-                                 (self.get_field_names(measurement)[0], measurement))[0]['time']
+                                 (field_name, measurement))[0]['time']
         ts = self.date_str_to_ts_nanos(date_str)
         return date_str, ts
 
-    def get_end_time(self, measurement):
+    def get_end_time(self, measurement, field_name=None):
         """
         Get end date/time of Measurement.
         :param measurement: 
+        :param field_name: field to query, default first field of Measurement
         :return tuple of: endtime as UTC string, timestamp in nanos: 
         """
+        if field_name is None:
+            field_name = self.get_field_names(measurement)[0]
         date_str = self.query_db('SELECT LAST(%s), time FROM %s' %
-                                 (self.get_field_names(measurement)[0], measurement))[0]['time']
+                                 (field_name, measurement))[0]['time']
         ts = self.date_str_to_ts_nanos(date_str)
         return date_str, ts
 
     def query_db(self, query):
         log.info("Querying database: %s", query)
-        result = self.client.query(query)
+        result = self.get_client().query(query)
 
         if result.error is not None:
             log.warning("Error while querying influxdb: %s", result.error)
@@ -139,6 +206,51 @@ class InfluxDbInput(Input):
 
         return result_out
 
+    def query_db_iter(self, query):
+        """
+        Generator of result points (dicts like get_points()) for query.
+        Streams chunked responses if chunk_size > 0, raises InfluxDBClientError on
+        an error response or error in the results.
+        """
+        if self.chunk_size <= 0:
+            for point in self.query_db(query):
+                yield point
+            return
+
+        log.info("Querying database (chunk_size=%d): %s", self.chunk_size, query)
+        # Via the client as its query() does: same URL, SSL, auth, raises on non-2xx status
+        params = {'q': query, 'db': self.database, 'chunked': 'true', 'chunk_size': self.chunk_size}
+        response = self.get_client().request(url='query', method='GET', params=params,
+                                             stream=True, expected_response_code=200)
+        count = 0
+        try:
+            # Each line is a JSON chunk of (partial) results
+            for line in response.iter_lines():
+                if not line:
+                    continue
+
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise InfluxDBClientError(chunk['error'])
+
+                for result in chunk.get('results', []):
+                    if 'error' in result:
+                        raise InfluxDBClientError(result['error'])
+
+                    for series in result.get('series', []):
+                        columns = series['columns']
+                        tags = series.get('tags')
+                        for values in series.get('values', []):
+                            point = dict(zip(columns, values))
+                            if tags:
+                                point.update(tags)
+                            count += 1
+                            yield point
+        finally:
+            response.close()
+
+        log.info("Received %s results" % count)
+
     def read(self, packet):
         result_out = self.query_db(self.query)
         packet.data = result_out
@@ -10,17 +10,36 @@ import calendar
 import Geohash
 import requests
 import base64
+import threading
+import time
+import zlib
+from Queue import Queue, Empty, Full
 
 from stetl.outputs.httpoutput import HttpOutput
 from stetl.util import Util
 from stetl.packet import FORMAT
 from stetl.component import Config
+from smartem.util.lrucache import LRUCache
+from smartem.util.spool import Spool
 
 log = Util.get_log('influxdboutput')
 
 # constant for time conversion
 NANOS = int(1000 * 1000 * 1000)
 
+# Timestamp factor from seconds per write precision
+PRECISIONS = {'s': 1, 'ms': 1000, 'u': 1000 * 1000, 'ns': NANOS}
+
+
+def escape_key(value, chars=', ='):
+    # Escape special chars in tag keys, tag values and field keys with backslash (Line Protocol).
+    # For measurement names only comma and space.
+    value = str(value)
+    for char in chars:
+        if char in value:
+            value = value.replace(char, '\\' + char)
+    return value
+
 
 class InfluxDbOutput(HttpOutput):
     """
@@ -54,6 +73,10 @@ class InfluxDbOutput(HttpOutput):
         geohash_field_precision = 12
         geohash_wkt_attr = point  or geohash_map = {{'lat': 'lat', 'lon': 'lon' }}
         time_attr = time
+        max_lines = 5000
+        gzip = True
+        precision = s
+        spool_dir = /var/smartem/spool/influxdb
         user = theuser
         password = thepass
 
@@ -189,6 +212,18 @@ class InfluxDbOutput(HttpOutput):
         """
         pass
 
+    @Config(ptype=int, default=10000, required=False)
+    def geohash_cache_size(self):
+        """
+        Number of locations (WKT strings or lat/lon pairs) for which the geohashes are cached.
+        Stations are mostly static, so few locations repeat. 0 means no caching.
+
+        Default: 10000
+
+        Required: False
+        """
+        pass
+
     @Config(ptype=str, required=True)
     def time_attr(self):
         """
@@ -201,56 +236,343 @@ class InfluxDbOutput(HttpOutput):
         """
         pass
 
+    @Config(ptype=int, default=5000, required=False)
+    def max_lines(self):
+        """
+        Maximum number of lines (points) per POST, larger payloads are split. 0 means no maximum.
+
+        Default: 5000
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=0, required=False)
+    def max_bytes(self):
+        """
+        Maximum number of bytes per POST, larger payloads are split. 0 means no maximum.
+
+        Default: 0
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=0, required=False)
+    def max_retries(self):
+        """
+        Number of retries for a POST on server errors (5xx) and connection errors/timeouts,
+        with exponential backoff (retry_backoff, 2 * retry_backoff, 4 * retry_backoff...).
+
+        Default: 0
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=float, default=1.0, required=False)
+    def retry_backoff(self):
+        """
+        Seconds to wait before first retry, doubled for each next retry.
+
+        Default: 1.0
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=float, default=0.0, required=False)
+    def timeout(self):
+        """
+        Timeout in seconds for a POST, 0 means no timeout.
+
+        Default: 0.0
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=bool, default=False, required=False)
+    def async_write(self):
+        """
+        Write asynchronously: payloads are queued and POSTed by a background writer thread,
+        coalescing lines from multiple packets (up to max_lines/max_bytes or flush_interval).
+        The queue is drained on exit.
+
+        Default: False
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=100, required=False)
+    def queue_size(self):
+        """
+        Maximum number of payload chunks queued for the writer thread, writing packets waits when full.
+
+        Default: 100
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=float, default=5.0, required=False)
+    def flush_interval(self):
+        """
+        Maximum seconds the writer thread holds lines before POSTing.
+
+        Default: 5.0
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=bool, default=False, required=False)
+    def gzip(self):
+        """
+        Gzip-compress POST bodies (Content-Encoding: gzip). Payloads are compressed
+        in parts while sending (chunked transfer encoding).
+
+        Default: False
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=str, default='ns', required=False)
+    def precision(self):
+        """
+        Write precision of timestamps: s, ms, u or ns. Use s when the time_attr has
+        second resolution to avoid padding timestamps to nanoseconds.
+
+        Default: 'ns'
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=str, default=None, required=False)
+    def spool_dir(self):
+        """
+        Optional directory to spool payloads that could not be delivered (server or connection errors,
+        after retries). Spooled payloads are replayed in order at init (next run) and when
+        a POST succeeds again (server recovered).
+
+        Default: None
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=16, required=False)
+    def spool_segment_mb(self):
+        """
+        Maximum size in MB of a spool segment file before starting a new segment.
+
+        Default: 16
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=3600, required=False)
+    def spool_segment_age(self):
+        """
+        Maximum seconds to append to a spool segment file before starting a new segment.
+
+        Default: 3600
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=1024, required=False)
+    def spool_max_mb(self):
+        """
+        Maximum total size in MB of the spool, oldest segments are dropped when exceeded.
+
+        Default: 1024
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=168, required=False)
+    def spool_max_age(self):
+        """
+        Maximum hours to keep a spool segment, older segments are dropped.
+
+        Default: 168
+
+        Required: False
+        """
+        pass
+
+    @Config(ptype=int, default=10, required=False)
+    def spool_fsync_batches(self):
+        """
+        Number of spooled payloads to write before fsync of the spool segment.
+        Segments are always synced before replay and at exit.
+
+        Default: 10
+
+        Required: False
+        """
+        pass
+
     def __init__(self, configdict, section):
         HttpOutput.__init__(self, configdict, section, consumes=FORMAT.record_array)
 
         # Construct write path
-        self.path = '/write?db=%s' % self.database
+        if self.precision not in PRECISIONS:
+            raise ValueError('Unsupported precision %s, use one of %s' % (self.precision, str(sorted(PRECISIONS))))
+
+        self.time_factor = PRECISIONS[self.precision]
+        self.path = '/write?db=%s&precision=%s' % (self.database, self.precision)
 
-        # Construct the template line to be used for each data frame
-        # We split into separate sub-templates for tags, fields, optional geohashes
+        # Escape measurement, tag and field keys once, values are escaped per record
+        # e.g. joseraw,station=19,component=no2raw value=12345,geohash_tag=uvx53kryp 1434055562000000000
+        self.measurement_key = escape_key(self.measurement, ', ')
 
-        # Optional Tags template
-        self.tags_template = None
+        # Optional Tags: list of (escaped key, record attr)
+        self.tags = []
         if self.tags_map:
-            self.tags = self.tags_map.keys()
-            self.tags_template = ''
-            for tag in self.tags:
-                if self.tags_template:
-                    # Additional tags
-                    self.tags_template += ',' + tag + '=%s'
-                else:
-                    # First or one tag
-                    self.tags_template = tag + '=%s'
-
-        # Required Fields template (need at least one field)
-        self.fields_template = None
-        self.fields = self.fields_map.keys()
-        for field in self.fields:
-            if self.fields_template:
-                # Additional fields
-                self.fields_template += ',' + field + '=%s'
-            else:
-                # First or one field
-                self.fields_template = field + '=%s'
-
-        # Optional extra geohash as tag template
+            self.tags = [(escape_key(tag), self.tags_map[tag]) for tag in self.tags_map]
+
+        # Required Fields (need at least one field): list of (escaped key, record attr)
+        self.fields = [(escape_key(field), self.fields_map[field]) for field in self.fields_map]
+
+        # Optional extra geohash as tag and/or field
         if self.geohash_tag:
-            self.geohash_tag_template = ',' + self.geohash_tag_name + '=%s'
+            self.geohash_tag_key = escape_key(self.geohash_tag_name)
 
-        # Optional extra geohash as field template
         if self.geohash_field:
-            self.geohash_field_template = ',' + self.geohash_field_name + '="%s"'
+            self.geohash_field_key = escape_key(self.geohash_field_name)
 
-        # will expand to <measurement>,<tags> <fields>
-        # e.g. joseraw,station=19,component=no2raw value=12345,geohash_tag=uvx53kryp 1434055562000000000
-        # tags, fields and timestamp will be substituted when creating payload
-        self.template_data_line = self.measurement + ',%s %s %d\n'
+        # Cache of location to (geohash tag, geohash field)
+        self.geohash_cache = None
+        if (self.geohash_tag or self.geohash_field) and self.geohash_cache_size > 0:
+            self.geohash_cache = LRUCache(self.geohash_cache_size)
 
         self.base_path = self.path
         self.base_url = 'http://%s:%d%s' % (self.host, self.port, self.path)
         self.http_session = requests.Session()
 
+        # Async writer: queue of payload chunks, None to stop, error if writer thread failed
+        self.writer_queue = None
+        self.writer_thread = None
+        self.writer_error = None
+        self.spool = None
+
+    def init(self):
+        HttpOutput.init(self)
+        if self.spool_dir:
+            self.spool = Spool(self.spool_dir, segment_bytes=self.spool_segment_mb * 1024 * 1024,
+                               segment_age=self.spool_segment_age,
+                               max_bytes=self.spool_max_mb * 1024 * 1024,
+                               max_age=self.spool_max_age * 3600, fsync_batches=self.spool_fsync_batches)
+
+            # Replay payloads spooled in previous run
+            if self.spool.has_pending():
+                self.spool.replay(self.post_spooled)
+
+        if self.async_write:
+            self.writer_queue = Queue(self.queue_size)
+            self.writer_thread = threading.Thread(target=self.write_queued, name='influxdb-writer')
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+
+    def exit(self):
+        if self.writer_thread:
+            # Drain queue
+            log.info('Flushing %d queued chunks' % self.writer_queue.qsize())
+            try:
+                self.put_queued(None)
+                self.writer_thread.join()
+            except Exception as e:
+                log.error('Cannot flush queued chunks: %s' % str(e))
+            self.writer_thread = None
+
+        if self.spool:
+            self.spool.close()
+
+        if self.geohash_cache is not None:
+            log.info('Geohash cache: %d locations, %d hits, %d misses' %
+                     (len(self.geohash_cache), self.geohash_cache.hits, self.geohash_cache.misses))
+
+        HttpOutput.exit(self)
+
+    def write_queued(self):
+        # Writer thread: record failure such that put_queued() raises instead of blocking
+        try:
+            self.coalesce_queued()
+        except Exception as e:
+            log.error('Writer thread failed: %s' % str(e))
+            self.writer_error = e
+
+    def put_queued(self, chunk):
+        # Queue chunk for writer thread, wait when full while the writer thread runs
+        while True:
+            if self.writer_error is not None or not self.writer_thread.is_alive():
+                raise Exception('InfluxDB writer thread not running: %s' % str(self.writer_error))
+
+            try:
+                self.writer_queue.put(chunk, True, 1)
+                return
+            except Full:
+                pass
+
+    def post_queued(self, payload):
+        # Writer thread: log errors per payload and keep running
+        try:
+            self.post_with_retry(payload)
+        except Exception as e:
+            log.error('Error posting %d queued lines: %s' % (payload.count('\n'), str(e)))
+
+    def coalesce_queued(self):
+        # Writer thread: coalesce queued chunks up to max_lines/max_bytes or flush_interval
+        chunks = []
+        lines = 0
+        size = 0
+        deadline = None
+        while True:
+            chunk = False
+            try:
+                wait = None
+                if deadline is not None:
+                    wait = max(deadline - time.time(), 0.01)
+                chunk = self.writer_queue.get(True, wait)
+            except Empty:
+                pass
+
+            if chunk:
+                chunk_lines = chunk.count('\n')
+                if len(chunks) > 0 and ((self.max_lines > 0 and lines + chunk_lines > self.max_lines) or
+                                        (self.max_bytes > 0 and size + len(chunk) > self.max_bytes)):
+                    self.post_queued(''.join(chunks))
+                    chunks = []
+                    lines = 0
+                    size = 0
+
+                if len(chunks) == 0:
+                    deadline = time.time() + self.flush_interval
+
+                chunks.append(chunk)
+                lines += chunk_lines
+                size += len(chunk)
+
+            # Flush when full, after flush_interval or at stop
+            if len(chunks) > 0 and (chunk is None or chunk is False or
+                                    (self.max_lines > 0 and lines >= self.max_lines)):
+                self.post_queued(''.join(chunks))
+                chunks = []
+                lines = 0
+                size = 0
+                deadline = None
+
+            if chunk is None:
+                return
+
     def create_payload(self, packet):
         """
          Create the POST body (payload) as string using InfluxDB Line Protocol,
@@ -270,72 +592,112 @@ class InfluxDbOutput(HttpOutput):
 
         log.info("Creating payload from %d records" % len(records))
 
-        payload = ''
-
+        # Collect lines per chunk, each chunk within max_lines and max_bytes
+        chunks = []
+        lines = []
+        size = 0
         for record in records:
+            line = self.create_line(record)
+            if len(lines) > 0 and ((self.max_lines > 0 and len(lines) >= self.max_lines) or
+                                   (self.max_bytes > 0 and size + len(line) > self.max_bytes)):
+                chunks.append(''.join(lines))
+                lines = []
+                size = 0
+
+            lines.append(line)
+            size += len(line)
+
+        if len(lines) > 0:
+            chunks.append(''.join(lines))
+
+        log.info("Created payload of %d characters in %d chunks" % (sum([len(chunk) for chunk in chunks]), len(chunks)))
 
-            # Make Timestamp in Unixtime nanosecs, e.g. 1434055562000000000
-            # NB assumed is that input time attr is in UTC!
-            # See http://stackoverflow.com/questions/2956886/python-calendar-timegm-vs-time-mktime
-            # mktime assumes local timezone!
-            # tstamp_nanos = int(time.mktime(record[self.time_attr].timetuple()) * nanos)
-            tstamp_nanos = int(calendar.timegm(record[self.time_attr].timetuple()) * NANOS)
-
-            # Create optional tags substring using template
-            tags = ''
-            if self.tags_template:
-                tag_values = []
-                for tag in self.tags:
-                    tag_values.append(str(record[self.tags_map[tag]]))
-                tag_values = tuple(tag_values)
-                tags = self.tags_template % tag_values
-
-            # Create required field(s) substring using template
-            field_values = []
-            for field in self.fields:
-                field_values.append(str(record[self.fields_map[field]]))
-            field_values = tuple(field_values)
-            fields = self.fields_template % field_values
-
-            # Optional geohash as field and/or tag,
-            # see https://github.com/vinsci/geohash/
-            if self.geohash_tag or self.geohash_field:
-                lat = None
-                lon = None
-
-                # Determine where to get lat/lon from
-                # Option 1: map to record attrs
-                if self.geohash_map:
-                    lat = record.get(self.geohash_map['lat'])
-                    lon = record.get(self.geohash_map['lon'])
-
-                # Option 2: map to WKT-encoded Point in record
-                elif self.geohash_wkt_attr:
-                    # WKT example: 'SRID=4326;POINT(5.670993 51.472393)'
-                    wkt = record.get(self.geohash_wkt_attr)
-                    if wkt:
-                        # TODO: Poor-man's extraction: should be using regex or geo-lib
-                        # NB the order is lon, lat in WKT!
-                        lon = float(wkt.split('(')[1].split(' ')[0])
-                        lat = float(wkt.split(' ')[1].split(')')[0])
-
-                if lat and lon:
-                    if self.geohash_tag:
-                        geohash_tag_val = Geohash.encode(lat, lon, self.geohash_tag_precision)
-                        geohash_tag = self.geohash_tag_template % geohash_tag_val
-                        tags += geohash_tag
-                        
-                    if self.geohash_field:
-                        geohash_field_val = Geohash.encode(lat, lon, self.geohash_field_precision)
-                        geohash_field = self.geohash_field_template % geohash_field_val
-                        fields += geohash_field
-
-            # Assemble InfluxDB line protocol string, each measurement on a new line
-            payload += self.template_data_line % (tags, fields, tstamp_nanos)
-
-        log.info("Created payload of %d characters" % len(payload))
-
-        return payload
+        return chunks
+
+    def create_line(self, record):
+        """
+        Create single InfluxDB Line Protocol line for record.
+        """
+
+        # Make Timestamp in Unixtime in precision, e.g. nanosecs 1434055562000000000
+        # NB assumed is that input time attr is in UTC!
+        # See http://stackoverflow.com/questions/2956886/python-calendar-timegm-vs-time-mktime
+        # mktime assumes local timezone!
+        # tstamp_nanos = int(time.mktime(record[self.time_attr].timetuple()) * nanos)
+        tstamp = int(calendar.timegm(record[self.time_attr].timetuple()) * self.time_factor)
+
+        # Measurement with optional tags
+        tags = [self.measurement_key]
+        for key, attr in self.tags:
+            tags.append(key + '=' + escape_key(record[attr]))
+
+        # Required field(s)
+        fields = []
+        for key, attr in self.fields:
+            fields.append(key + '=' + str(record[attr]))
+
+        # Optional geohash as field and/or tag,
+        # see https://github.com/vinsci/geohash/
+        if self.geohash_tag or self.geohash_field:
+            tag_hash, field_hash = self.get_geohashes(record)
+            if tag_hash:
+                tags.append(self.geohash_tag_key + '=' + tag_hash)
+
+            if field_hash:
+                fields.append(self.geohash_field_key + '="' + field_hash + '"')
+
+        # Assemble InfluxDB line protocol string, each measurement on a new line
+        return '%s %s %d\n' % (','.join(tags), ','.join(fields), tstamp)
+
+    def get_geohashes(self, record):
+        # Geohash for tag and field (or None), cached per location (WKT string or lat/lon)
+        key = None
+        if self.geohash_cache is not None:
+            if self.geohash_map:
+                key = (record.get(self.geohash_map['lat']), record.get(self.geohash_map['lon']))
+            elif self.geohash_wkt_attr:
+                key = record.get(self.geohash_wkt_attr)
+
+            geohashes = self.geohash_cache.get(key)
+            if geohashes:
+                return geohashes
+
+        tag_hash = None
+        field_hash = None
+        lat, lon = self.get_lat_lon(record)
+        if lat and lon:
+            if self.geohash_tag:
+                tag_hash = Geohash.encode(lat, lon, self.geohash_tag_precision)
+
+            if self.geohash_field:
+                field_hash = Geohash.encode(lat, lon, self.geohash_field_precision)
+
+        if self.geohash_cache is not None:
+            self.geohash_cache.put(key, (tag_hash, field_hash))
+
+        return tag_hash, field_hash
+
+    def get_lat_lon(self, record):
+        lat = None
+        lon = None
+
+        # Determine where to get lat/lon from
+        # Option 1: map to record attrs
+        if self.geohash_map:
+            lat = record.get(self.geohash_map['lat'])
+            lon = record.get(self.geohash_map['lon'])
+
+        # Option 2: map to WKT-encoded Point in record
+        elif self.geohash_wkt_attr:
+            # WKT example: 'SRID=4326;POINT(5.670993 51.472393)'
+            wkt = record.get(self.geohash_wkt_attr)
+            if wkt:
+                # TODO: Poor-man's extraction: should be using regex or geo-lib
+                # NB the order is lon, lat in WKT!
+                lon = float(wkt.split('(')[1].split(' ')[0])
+                lat = float(wkt.split(' ')[1].split(')')[0])
+
+        return lat, lon
 
     def post_to_url(self, payload):
         self.req_nr += 1
@@ -359,12 +721,19 @@ class InfluxDbOutput(HttpOutput):
 
         log.info('POST to URL: %s ...' % url)
 
+        data = payload
+        if self.gzip:
+            # Compressed size unknown beforehand: chunked transfer encoding
+            headers["Content-Encoding"] = "gzip"
+            del headers["Content-Length"]
+            data = self.gzip_parts(payload)
+
         try:
             if self.user is not None:
                 auth = base64.encodestring('%s:%s' % (self.user, self.password)).replace('\n', '')
                 headers["Authorization"] = "Basic %s" % auth
 
-            r = self.http_session.post(url, data=payload, headers=headers)
+            r = self.http_session.post(url, data=data, headers=headers, timeout=self.timeout or None)
             response_text = r.text
             status_code = r.status_code
             status_msg = str(r.status_code)
@@ -384,9 +753,70 @@ class InfluxDbOutput(HttpOutput):
 
         return status_code, status_msg, response_text
 
-    # Called by HttpOutput base class after create_payload(), overridden
-    def post(self, packet, payload):
+    @staticmethod
+    def gzip_parts(payload, part_size=65536):
+        # Generator of gzip-compressed parts of payload
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for start in range(0, len(payload), part_size):
+            part = compressor.compress(payload[start:start + part_size])
+            if part:
+                yield part
+
+        yield compressor.flush()
+
+    def post_with_retry(self, payload):
+        # POST, retry with exponential backoff on server errors and connection errors/timeouts (status 0)
+        retry = 0
+        while True:
+            statuscode, statusmessage, res = self.post_to_url(payload)
+            if statuscode in [200, 204] or (0 < statuscode < 500) or retry >= self.max_retries:
+                break
+
+            wait = self.retry_backoff * (2 ** retry)
+            retry += 1
+            log.warn('POST failed with status=%d, retry %d of %d in %.1f secs' % (statuscode, retry, self.max_retries, wait))
+            time.sleep(wait)
+
+        if statuscode in [200, 204]:
+            # Server (again) available: replay spooled payloads
+            if self.spool and self.spool.has_pending():
+                self.spool.replay(self.post_spooled)
+        elif self.spool and (statuscode == 0 or statuscode >= 500):
+            log.warn('POST failed with status=%d, spooled %d lines' % (statuscode, payload.count('\n')))
+            self.spool.append(payload)
+        else:
+            log.error('POST failed with status=%d, dropped %d lines' % (statuscode, payload.count('\n')))
+
+        return statuscode, statusmessage, res
 
+    def post_spooled(self, payload):
+        # Replay single spooled payload, True if done with it
         statuscode, statusmessage, res = self.post_to_url(payload)
+        if 0 < statuscode < 500 and statuscode not in [200, 204]:
+            # Client error, e.g. invalid lines: will never succeed
+            log.error('Replay failed with status=%d, dropped %d spooled lines' % (statuscode, payload.count('\n')))
+            return True
 
-        return statuscode, statusmessage, res
+        return statuscode in [200, 204]
+
+    # Called by HttpOutput base class after create_payload(), overridden
+    def post(self, packet, payload):
+        # payload: list of chunks, result is first failure or last success
+        if self.writer_thread:
+            for chunk in payload:
+                self.put_queued(chunk)
+            return 204, 'Queued', ''
+
+        result = None
+        for chunk in payload:
+            statuscode, statusmessage, res = self.post_with_retry(chunk)
+            if result is None or result[0] in [200, 204]:
+                result = statuscode, statusmessage, res
+
+        if result is None:
+            result = 204, 'No Content', ''
+
+        return result
@@ -4,8 +4,13 @@
 #
 # Author: Just van den Broecke
 
+import threading
+from collections import deque
+from Queue import Queue, Full
+
 from stetl.component import Config
 from stetl.util import Util
+from stetl.postgis import PostGIS
 from stetl.inputs.dbinput import PostgresDbInput
 
 log = Util.get_log("SmartemDbInput")
@@ -44,6 +49,30 @@ class RawDbInput(PostgresDbInput):
         """
         pass
 
+    @Config(ptype=int, required=False, default=0)
+    def fetch_size(self):
+        """
+        Stream records: number of records to fetch at once from a server-side cursor
+        on range_query. 0 means fetch each record with gids_query and data_query.
+        """
+        pass
+
+    @Config(ptype=str, required=False, default=None)
+    def range_query(self):
+        """
+        The query (string) to fetch data records for gid range (last_gid, last_gid + max_input_records]
+        ordered by gid. Required when fetch_size > 0.
+        """
+        pass
+
+    @Config(ptype=int, required=False, default=0)
+    def prefetch(self):
+        """
+        Maximum number of records to prefetch in a background thread, using its own
+        DB connection, while the chain processes earlier records. 0 means no prefetching.
+        """
+        pass
+
     def __init__(self, configdict, section):
         PostgresDbInput.__init__(self, configdict, section)
 
@@ -58,6 +87,16 @@ class RawDbInput(PostgresDbInput):
         self.ts_gid = -1
         self.last_gid = 0
 
+        # Streaming: server-side cursor on current gid range and buffer of fetched records
+        self.range_cursor = None
+        self.buffer = deque()
+
+        # Prefetching: thread putting (last_gid, record) into queue, None at end
+        self.prefetch_thread = None
+        self.prefetch_queue = None
+        self.prefetch_stop = threading.Event()
+        self.prefetch_done = False
+
     def next_entry(self, a_list, idx):
         if len(a_list) == 0 or idx >= len(a_list):
             idx = -1
@@ -72,7 +111,17 @@ class RawDbInput(PostgresDbInput):
         PostgresDbInput.init(self)
 
         self.read_gids()
-        self.read_records()
+        if self.prefetch > 0:
+            self.start_prefetch()
+        elif self.fetch_size > 0:
+            self.open_range()
+        else:
+            self.read_records()
+
+    def exit(self):
+        self.stop_prefetch()
+        self.close_range()
+        PostgresDbInput.exit(self)
 
     def read_gids(self):
 
@@ -93,7 +142,174 @@ class RawDbInput(PostgresDbInput):
         for rec in ts_gid_recs:
             self.ts_gids.append(rec['gid'])
 
+    def open_range(self):
+        # Server-side (named) cursor for gid range: records are fetched in batches of fetch_size
+        self.close_range()
+        self.range_cursor = self.create_range_cursor(self.db, self.last_gid, 'rawdbinput_%d' % self.last_gid)
+
+    def create_range_cursor(self, db, last_gid, name):
+        cursor = db.connection.cursor(name=name)
+        cursor.itersize = self.fetch_size
+        cursor.execute(self.range_query % (last_gid, last_gid + self.max_input_records))
+        return cursor
+
+    def close_range(self):
+        if self.range_cursor is not None:
+            self.range_cursor.close()
+            self.range_cursor = None
+
+            # End transaction of named cursor
+            self.db.commit(close=False)
+
+    def fetch_records(self):
+        # Fetch next batch of records from range cursor into buffer
+        db_records = self.range_cursor.fetchmany(self.fetch_size)
+        if len(db_records) > 0:
+            column_names = [desc[0] for desc in self.range_cursor.description]
+            self.buffer.extend(self.tuples_to_records(db_records, column_names))
+
+        return len(db_records)
+
+    def read_stream(self, packet):
+        if len(self.buffer) == 0 and self.fetch_records() == 0:
+            # Range done
+            self.close_range()
+            if self.read_once:
+                # One round: we're done
+                packet.set_end_of_stream()
+                log.info('Nothing to do. All file_records done')
+                return packet
+
+            # Continue fetching recs from from last_gid
+            self.last_gid += self.max_input_records
+            self.open_range()
+            if self.fetch_records() == 0:
+                self.close_range()
+                packet.set_end_of_stream()
+                log.info('Nothing to do. read_once=False, All file_records done')
+                return packet
+
+            log.info('Continuing from gid=%d' % self.buffer[0]['gid'])
+
+        packet.data = self.buffer.popleft()
+        self.ts_gid = packet.data['gid']
+
+        return packet
+
+    def start_prefetch(self):
+        self.prefetch_queue = Queue(self.prefetch)
+        self.prefetch_thread = threading.Thread(target=self.prefetch_records, name='rawdbinput-prefetch')
+        self.prefetch_thread.daemon = True
+        self.prefetch_thread.start()
+        log.info('Started prefetching from gid=%d' % self.last_gid)
+
+    def stop_prefetch(self):
+        if self.prefetch_thread is None:
+            return
+
+        self.prefetch_stop.set()
+        self.prefetch_thread.join()
+        self.prefetch_thread = None
+
+    def put_prefetched(self, item):
+        # Put in queue, waiting while full unless stopped
+        while not self.prefetch_stop.is_set():
+            try:
+                self.prefetch_queue.put(item, True, 1)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def prefetch_records(self):
+        # Prefetch thread: own DB connection, same gid ranges as read()
+        # An error is passed to read_prefetched() to be raised there, None marks the end
+        db = None
+        try:
+            db = PostGIS(self.cfg.get_dict())
+            db.connect()
+            for item in self.iter_records(db):
+                if not self.put_prefetched(item):
+                    return
+            self.put_prefetched(None)
+        except Exception as e:
+            log.error('Error prefetching records from gid=%d: %s' % (self.last_gid, str(e)))
+            self.put_prefetched(e)
+        finally:
+            if getattr(db, 'connection', None) is not None:
+                db.connection.close()
+
+    def iter_records(self, db):
+        # Generate (last_gid, record) for gid ranges until read_once or empty range
+        last_gid = self.last_gid
+        first = True
+        while not self.prefetch_stop.is_set():
+            count = 0
+            for record in self.iter_range(db, last_gid):
+                count += 1
+                yield last_gid, record
+
+            if self.read_once or (count == 0 and not first):
+                return
+
+            first = False
+            last_gid += self.max_input_records
+            log.info('Prefetching from gid=%d' % last_gid)
+
+    def iter_range(self, db, last_gid):
+        # Generate data records for gid range (last_gid, last_gid + max_input_records]
+        if self.fetch_size > 0:
+            cursor = self.create_range_cursor(db, last_gid, 'rawdbinput_prefetch_%d' % last_gid)
+            try:
+                while True:
+                    db_records = cursor.fetchmany(self.fetch_size)
+                    if len(db_records) == 0:
+                        break
+
+                    column_names = [desc[0] for desc in cursor.description]
+                    for record in self.tuples_to_records(db_records, column_names):
+                        yield record
+            finally:
+                cursor.close()
+                db.commit(close=False)
+        else:
+            db.execute(self.gids_query % (last_gid, last_gid + self.max_input_records))
+            ts_gids = [rec[0] for rec in db.cursor.fetchall()]
+            for ts_gid in ts_gids:
+                db.execute(self.data_query % ts_gid)
+                db_records = db.cursor.fetchall()
+                if len(db_records) == 1:
+                    column_names = [desc[0] for desc in db.cursor.description]
+                    yield self.tuples_to_records(db_records, column_names)[0]
+
+    def read_prefetched(self, packet):
+        item = None
+        if not self.prefetch_done:
+            item = self.prefetch_queue.get()
+
+        if isinstance(item, Exception):
+            self.prefetch_done = True
+            raise item
+
+        if item is None:
+            self.prefetch_done = True
+            packet.set_end_of_stream()
+            log.info('Nothing to do. All file_records done')
+            return packet
+
+        # Progress as seen by the chain, not by the prefetch thread
+        self.last_gid, packet.data = item
+        self.ts_gid = packet.data['gid']
+
+        return packet
+
     def read(self, packet):
+        if self.prefetch > 0:
+            return self.read_prefetched(packet)
+
+        if self.fetch_size > 0:
+            return self.read_stream(packet)
 
         # Next entry from ts record list
         self.ts_gid, self.ts_gids_idx = self.next_entry(self.ts_gids, self.ts_gids_idx)
@@ -4,13 +4,17 @@
 #
 # Author:Just van den Broecke
 
+import calendar
 import json
 import time
 import random
+from urllib2 import Request, urlopen, HTTPError
 from stetl.component import Config
 from stetl.util import Util
 from stetl.inputs.httpinput import HttpInput
 from stetl.packet import FORMAT
+from smartem.util.httpcache import HttpCache
+from smartem.util.tokenbucket import TokenBucket
 
 log = Util.get_log("RawSensorAPI")
 
@@ -31,6 +35,41 @@ class RawSensorAPIInput(HttpInput):
         """
         pass
 
+    @Config(ptype=int, default=1, required=False)
+    def concurrency(self):
+        """
+        The max number of concurrent requests to the RSA API (devices fetched at once).
+
+        Required: False
+
+        Default: 1
+        """
+        pass
+
+    @Config(ptype=float, default=0.0, required=False)
+    def max_requests_per_sec(self):
+        """
+        Max requests per second to the RSA API (token bucket), shared by concurrent requests.
+        If set or if concurrency > 1, api_interval_secs is not applied. 0 means no limit.
+
+        Required: False
+
+        Default: 0.0
+        """
+        pass
+
+    @Config(ptype=str, default=None, required=False)
+    def http_cache_file(self):
+        """
+        Optional SQLite file to cache device, days and hours listings. Listings are revalidated
+        with conditional GET (ETag/Last-Modified), hours listings of past days are never fetched again.
+
+        Required: False
+
+        Default: None
+        """
+        pass
+
     @Config(ptype=list, default=[], required=False)
     def skip_devices(self):
         """
@@ -54,6 +93,14 @@ class RawSensorAPIInput(HttpInput):
         self.base_url = self.url
         self.url = None
 
+        self.rate_limiter = None
+        if self.max_requests_per_sec > 0:
+            self.rate_limiter = TokenBucket(self.max_requests_per_sec)
+
+        self.http_cache = None
+        if self.http_cache_file:
+            self.http_cache = HttpCache(self.http_cache_file)
+
     def init(self):
         pass
 
@@ -100,15 +147,85 @@ class RawSensorAPIInput(HttpInput):
         """
 
         # just pause to not overstress the RSA
-        if self.api_interval_secs > 0:
+        if self.api_interval_secs > 0 and self.rate_limiter is None and self.concurrency <= 1:
             time.sleep(self.api_interval_secs)
 
         return True
 
     def exit(self):
         # done
+        if self.http_cache:
+            self.http_cache.close()
+            self.http_cache = None
+
         log.info('Exit')
 
+    def read_from_url(self, url, parameters=None):
+        """
+        Read the data from the URL, paced by max_requests_per_sec if set.
+        """
+        if self.http_cache and not parameters and self.is_cacheable(url):
+            return self.read_from_url_cached(url)
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+        return HttpInput.read_from_url(self, url, parameters)
+
+    def is_cacheable(self, url):
+        # Listings: /devices, /devices/<id>/timeseries and /devices/<id>/timeseries/<day>
+        path = url[len(self.base_url):].strip('/').split('/')
+        return path == ['devices'] or (len(path) in [3, 4] and path[0] == 'devices' and path[2] == 'timeseries')
+
+    def is_immutable(self, url):
+        # Hours listing of day ended at least 2 hours ago (allow late uploads)
+        path = url[len(self.base_url):].strip('/').split('/')
+        if len(path) != 4:
+            return False
+
+        day_end = calendar.timegm(time.strptime(path[3], '%Y%m%d')) + 24 * 3600
+        return time.time() > day_end + 2 * 3600
+
+    def read_from_url_cached(self, url):
+        """
+        Read the data from the URL via the HTTP cache: immutable entries are not fetched,
+        others are fetched with conditional GET (If-None-Match/If-Modified-Since).
+        """
+        entry = self.http_cache.get(url)
+        if entry and entry['immutable']:
+            self.http_cache.hits += 1
+            return entry['body']
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+        request = Request(url)
+        if self.auth:
+            self.add_authorization(request)
+
+        if entry:
+            if entry['etag']:
+                request.add_header('If-None-Match', entry['etag'])
+            if entry['last_modified']:
+                request.add_header('If-Modified-Since', entry['last_modified'])
+
+        try:
+            response = urlopen(request)
+        except HTTPError as e:
+            if e.code == 304 and entry:
+                # Not Modified
+                self.http_cache.validated += 1
+                if self.is_immutable(url):
+                    self.http_cache.put(url, entry['body'], entry['etag'], entry['last_modified'], True)
+                return entry['body']
+            raise e
+
+        body = response.read()
+        self.http_cache.misses += 1
+        headers = response.info()
+        self.http_cache.put(url, body, headers.get('ETag'), headers.get('Last-Modified'), self.is_immutable(url))
+        return body
+
     def next_entry(self, a_list, idx):
         if len(a_list) == 0 or idx >= len(a_list):
             idx = -1
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# NumPy columns of raw sensor values for all samples within a raw (hour) record.
+#
+
+# Author: Just van den Broecke - 2015-2019
+
+import numpy
+
+
+class SampleColumns:
+    """
+    Lazily built NumPy columns (float arrays) of raw sensor values for all samples (dicts)
+    in a timeseries list. Absent or None values become NaN. Used by Refiner.refine_columnar().
+    """
+
+    def __init__(self, val_dicts):
+        self.val_dicts = val_dicts
+        self.columns = dict()
+
+    def __len__(self):
+        return len(self.val_dicts)
+
+    def get(self, name):
+        if name not in self.columns:
+            self.columns[name] = numpy.array([val_dict.get(name) for val_dict in self.val_dicts], dtype=float)
+
+        return self.columns[name]
+
+    def invalidate(self):
+        # Scalar converters may add or change values in the sample dicts (e.g. running mean filter)
+        self.columns = dict()
@@ -13,6 +13,7 @@ from stetl.packet import FORMAT
 from stetl.component import Config
 
 from refiner import Refiner
+from refinepool import RefinePool
 
 log = Util.get_log("RefineFilter")
 
@@ -46,9 +47,78 @@ class RefineFilter(Filter):
         """
         pass
 
+    @Config(ptype=str, default='sklearn', required=False)
+    def calibration_runtime(self):
+        """
+        Runtime for calibration models (Josene gases): 'sklearn' uses the pickled sklearn Pipeline,
+        'numpy' uses the NumPy-only forward pass (smartem.util.mlp.NumpyMLP).
+
+        Required: False
+
+        Default: sklearn
+        """
+        pass
+
+    @Config(ptype=str, default=None, required=False)
+    def compact_model_column(self):
+        """
+        Column of calibration_models with the compact (JSON) model, used with calibration_runtime 'numpy'.
+        If not set or empty for a model, the pickled model is converted when loaded.
+
+        Required: False
+
+        Default: None
+        """
+        pass
+
+    @Config(ptype=str, default='sample', required=False)
+    def refine_mode(self):
+        """
+        How to refine a raw (hour) record: 'sample' processes sample by sample,
+        'columnar' processes each sensor over all samples at once using NumPy.
+        Devices that do not support 'columnar' (e.g. AirSensEUR) always use 'sample'.
+
+        Required: False
+
+        Default: sample
+        """
+        pass
+
+    @Config(ptype=int, default=0, required=False)
+    def workers(self):
+        """
+        Number of worker processes to refine in parallel. Raw records are sharded
+        by device_id, each worker keeping the (calibration) state of its devices.
+        Refined records are output in input order. 0 means refine within this process.
+
+        Required: False
+
+        Default: 0
+        """
+        pass
+
+    @Config(ptype=int, default=200, required=False)
+    def max_pending(self):
+        """
+        Maximum number of raw records being refined by workers, before waiting for results.
+
+        Required: False
+
+        Default: 200
+        """
+        pass
+
     def __init__(self, configdict, section):
         Filter.__init__(self, configdict, section, consumes=FORMAT.record, produces=FORMAT.record_array)
         self.refiners = dict()
+        self.pool = None
+
+    def init(self):
+        if self.workers > 0:
+            # Start workers before any Refiner (DB connection) is initialized in this process
+            self.pool = RefinePool(self.workers, self.max_pending, self.cfg.config_dict,
+                                   self.sensor_names, self.refine_mode)
+            self.pool.start()
 
     def get_refiner(self, record):
         """
@@ -67,16 +137,31 @@ class RefineFilter(Filter):
 
             # One-time init of Refiner (may init calibration setup)
             refiner.init(self.cfg.config_dict)
+
+            # One-time compile of the sensors to refine for this device type
+            refiner.get_plan(self.sensor_names)
             self.refiners[device_type] = refiner
 
         return self.refiners[device_type]
 
     def exit(self):
+        if self.pool:
+            # Merge Device state from workers such that Refiner exit can save it
+            states = self.pool.stop()
+            for device_type in states:
+                refiner = self.get_refiner({'device_type': device_type})
+                if not refiner:
+                    continue
+                for state in states[device_type]:
+                    refiner.device.set_device_state(state)
+
         for device_type in self.refiners:
             # One-time exit of Refiner (may save calibration state)
             self.refiners[device_type].exit()
 
     def invoke(self, packet):
+        if self.pool:
+            return self.invoke_pool(packet)
 
         if packet.data is None or \
                 packet.is_end_of_doc() or \
@@ -90,6 +175,25 @@ class RefineFilter(Filter):
 
         # Let the Refiner specific to device type do all refinement steps
         # returning an array of records.
-        packet.data = refiner.refine(packet.data, self.sensor_names)
+        if self.refine_mode == 'columnar':
+            packet.data = refiner.refine_columnar(packet.data, self.sensor_names)
+        else:
+            packet.data = refiner.refine(packet.data, self.sensor_names)
+
+        return packet
+
+    def invoke_pool(self, packet):
+        if packet.data is not None and not packet.is_end_of_doc() and not packet.is_end_of_stream():
+            self.pool.submit(packet.data)
+
+        # Output refined records that are ready, all remaining at end of stream
+        if packet.is_end_of_stream():
+            records = self.pool.drain()
+        else:
+            records = self.pool.get_ready()
+
+        packet.data = None
+        if len(records) > 0:
+            packet.data = records
 
         return packet
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+# Pool of Refiner worker processes: raw records are sharded by device_id over the workers.
+#
+
+# Author: Just van den Broecke - 2015-2019
+
+import logging
+import multiprocessing
+import sys
+import traceback
+from Queue import Empty
+
+from refiner import Refiner
+
+log = logging.getLogger('RefinePool')
+
+
+def refine_worker(worker_id, config_dict, sensor_names, refine_mode, in_queue, result_queue):
+    """
+    Worker process: refine raw records from in_queue until None is received,
+    then report the Device state (calibration state, last values) of its devices.
+    """
+    refiners = dict()
+    device_ids = dict()
+    while True:
+        item = in_queue.get()
+        if item is None:
+            break
+
+        seq, record = item
+        records_out = None
+        try:
+            device_type = record['device_type']
+            if device_type not in refiners:
+                refiner = Refiner.get_refiner(device_type)
+                if refiner:
+                    # One-time init of Refiner (may init calibration setup)
+                    refiner.init(config_dict)
+                    refiner.get_plan(sensor_names)
+                refiners[device_type] = refiner
+                device_ids[device_type] = set()
+
+            refiner = refiners[device_type]
+            if refiner:
+                device_ids[device_type].add(record['device_id'])
+                if refine_mode == 'columnar':
+                    records_out = refiner.refine_columnar(record, sensor_names)
+                else:
+                    records_out = refiner.refine(record, sensor_names)
+        except Exception as e:
+            log.error('Worker %d: exception refining gid=%s err=%s' % (worker_id, str(record.get('gid')), str(e)))
+            traceback.print_exc(file=sys.stdout)
+
+        result_queue.put(('records', seq, records_out))
+
+    for device_type in refiners:
+        if refiners[device_type]:
+            state = refiners[device_type].device.get_device_state(device_ids[device_type])
+            result_queue.put(('state', device_type, state))
+
+    result_queue.put(('done', worker_id, None))
+
+
+class RefinePool:
+    """
+    Refines raw records in worker processes. Records are sharded by device_id such that
+    each worker owns the (calibration) state of its devices. Refined records are released
+    in the order the raw records were submitted. At stop() the Device state from the
+    workers is returned for merging into the Devices of the calling process.
+    """
+
+    def __init__(self, workers, max_pending, config_dict, sensor_names, refine_mode):
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.config_dict = config_dict
+        self.sensor_names = sensor_names
+        self.refine_mode = refine_mode
+        self.processes = list()
+        self.in_queues = list()
+        self.result_queue = None
+
+        # Reorder buffer: refined records by sequence nr
+        self.results = dict()
+        self.next_seq = 0
+        self.release_seq = 0
+        self.states = dict()
+        self.done_ids = set()
+
+    def start(self):
+        # Start before any Refiner/Device (DB connection) is initialized in this process
+        self.result_queue = multiprocessing.Queue()
+        for worker_id in range(self.workers):
+            in_queue = multiprocessing.Queue(self.max_pending)
+            process = multiprocessing.Process(target=refine_worker, name='refiner-%d' % worker_id,
+                                              args=(worker_id, self.config_dict, self.sensor_names,
+                                                    self.refine_mode, in_queue, self.result_queue))
+            process.daemon = True
+            process.start()
+            self.in_queues.append(in_queue)
+            self.processes.append(process)
+
+        log.info('Started %d refiner workers' % self.workers)
+
+    def get_pending(self):
+        return self.next_seq - self.release_seq
+
+    def submit(self, record):
+        # Shard by device: a device is always refined by the same worker, in order
+        worker_id = int(record['device_id']) % self.workers
+        self.in_queues[worker_id].put((self.next_seq, record))
+        self.next_seq += 1
+
+    def collect(self, block):
+        # Move results from workers into reorder buffer, block until at least one result
+        while True:
+            try:
+                kind, key, value = self.result_queue.get(block, 10)
+            except Empty:
+                if not block:
+                    return
+                self.check_workers()
+                continue
+
+            block = False
+            if kind == 'records':
+                self.results[key] = value
+            elif kind == 'state':
+                if key not in self.states:
+                    self.states[key] = list()
+                self.states[key].append(value)
+            elif kind == 'done':
+                self.done_ids.add(key)
+
+    def check_workers(self):
+        for worker_id, process in enumerate(self.processes):
+            if worker_id not in self.done_ids and not process.is_alive():
+                raise Exception('Refiner worker %d exited with code %s' % (worker_id, str(process.exitcode)))
+
+    def release(self):
+        # Refined records that are next in submit order
+        records = list()
+        while self.release_seq in self.results:
+            records_out = self.results.pop(self.release_seq)
+            self.release_seq += 1
+            if records_out:
+                records.extend(records_out)
+
+        return records
+
+    def get_ready(self):
+        """
+        Get refined records ready in submit order, wait while too many pending.
+        :return: list of records, possibly empty
+        """
+        self.collect(False)
+        while self.get_pending() >= self.max_pending and self.release_seq not in self.results:
+            self.collect(True)
+
+        return self.release()
+
+    def drain(self):
+        """
+        Wait for all submitted records.
+        :return: list of remaining refined records in submit order
+        """
+        records = list()
+        while self.get_pending() > 0:
+            if self.release_seq not in self.results:
+                self.collect(True)
+            records.extend(self.release())
+
+        return records
+
+    def stop(self):
+        """
+        Stop all workers.
+        :return: dict of device_type to list of Device states (one per worker)
+        """
+        for in_queue in self.in_queues:
+            in_queue.put(None)
+
+        # Consume all remaining results before joining (avoid blocking on full pipes)
+        while len(self.done_ids) < len(self.processes):
+            self.collect(True)
+
+        for process in self.processes:
+            process.join()
+
+        records = self.release()
+        if len(records) > 0:
+            log.warn('Discarded %d refined records at stop' % len(records))
+
+        log.info('Stopped %d refiner workers' % len(self.processes))
+        self.processes = list()
+        self.in_queues = list()
+        return self.states
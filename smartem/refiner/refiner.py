@@ -8,10 +8,13 @@
 import sys
 import traceback
 import math
+import numpy
 import pytz
 from datetime import datetime, timedelta
 
 from smartem.devices.devicereg import DeviceReg
+from smartem.refiner.columns import SampleColumns
+from smartem.refiner.sensorplan import SensorPlan
 import logging
 
 log = logging.getLogger('Refiner')
@@ -28,6 +31,9 @@ class Refiner:
         self.device = device
         self.config_dict = None
 
+        # Compiled SensorPlan per list of sensor names
+        self.plans = {}
+
     @staticmethod
     def get_refiner(device_type):
         """
@@ -59,6 +65,18 @@ class Refiner:
     def exit(self):
         self.device.exit()
 
+    def get_plan(self, sensor_names):
+        """
+        Get SensorPlan for sensor names, compiled once.
+        :param sensor_names: list of output sensor names
+        :return SensorPlan instance
+        """
+        key = tuple(sensor_names)
+        if key not in self.plans:
+            self.plans[key] = SensorPlan(self.device, sensor_names)
+
+        return self.plans[key]
+
     # M = M + (x-M)/n
     # Here M is the (cumulative moving) average, x is the new value in the
     # sequence, n is the count of values. Using floats as not to loose precision.
@@ -81,65 +99,175 @@ class Refiner:
     def has_err_msg(self, device_id, reason):
         return '%d-%s' % (device_id, reason) in self.error_msgs
 
-    def refine(self, record_in, sensor_names):
-        # Start dict of output records, key is sensor name, value is a record
-        records_out = dict()
-
-        gid_raw = -1
-        day = -1
-        hour = -1
+    def get_meta(self, record_in):
+        """
+        Get common (meta) attributes of raw input record.
+        :param record_in: raw (hour) record
+        :return: dict with gid_raw, day, hour, device_id, device_meta and unique_id
+        """
+        meta = dict()
+        meta['gid_raw'] = -1
+        meta['day'] = -1
+        meta['hour'] = -1
         if 'gid' in record_in:
-            gid_raw = record_in['gid']
+            meta['gid_raw'] = record_in['gid']
         if 'day' in record_in:
-            day = record_in['day']
+            meta['day'] = record_in['day']
         if 'hour' in record_in:
-            hour = record_in['hour']
+            meta['hour'] = record_in['hour']
 
-        device_id = record_in['device_id']
+        meta['device_id'] = record_in['device_id']
         if 'device_meta' in record_in:
-            device_meta = record_in['device_meta']
+            meta['device_meta'] = record_in['device_meta']
         else:
-            device_meta = self.device.get_meta_id(record_in['device_version'])
+            meta['device_meta'] = self.device.get_meta_id(record_in['device_version'])
+
+        meta['unique_id'] = 'device %d' % meta['device_id']
+        if 'unique_id' in record_in:
+            meta['unique_id'] = record_in['unique_id']
+
+        return meta
+
+    def create_record(self, record_in, meta, sensor_name, sensor_def, sensor_vals):
+        """
+        Start new output record for sensor with common data, subsequent data will be averaged.
+        :return: record or None if no location available
+        """
+        device_id = meta['device_id']
+        day = meta['day']
+        hour = meta['hour']
+        gid_raw = meta['gid_raw']
+        record = dict()
+
+        # gid_raw refers to harvested record, optional
+        if gid_raw > 0:
+            record['gid_raw'] = gid_raw
+
+        record['device_id'] = device_id
+        record['device_meta'] = meta['device_meta']
+        record['sensor_meta'] = self.device.get_sensor_meta_id(sensor_name, sensor_vals)
+
+        if day > 0:
+            # Refined timeseries table
+            record['day'] = day
+            record['hour'] = hour
+
+            # GMT does not know about 24 so we move to 00:00 the next day
+            day_hour = str(day) + str(hour)
+            if hour == 24:
+                # Need to move to 00:00 next day if hour is 24
+                # Just incrementing the day +1 is not enough: we may need to skip to next month
+                # http://stackoverflow.com/questions/3240458/how-to-increment-the-day-in-datetime-python
+                next_day = datetime.strptime('%sGMT' % str(day), '%Y%m%dGMT').replace(tzinfo=pytz.utc)
+                next_day += timedelta(days=1)
+                day_hour = next_day.strftime('%Y%m%d') + '0'
+
+            record['time'] = datetime.strptime('%sGMT' % day_hour, '%Y%m%d%HGMT').replace(tzinfo=pytz.utc)
+        else:
+            # For "last" values table
+
+            # Optional fields dependent on input record
+            if 'value_stale' in record_in:
+                record['value_stale'] = record_in['value_stale']
+
+            if 'device_name' in record_in:
+                record['device_name'] = record_in['device_name']
+
+            record['time'] = record_in['time']
+            if 'unique_id' in record_in:
+                record['unique_id'] = '%s-%s' % (str(record_in['unique_id']), sensor_name)
+            else:
+                record['unique_id'] = '%d-%s' % (device_id, sensor_name)
+
+        record['name'] = sensor_name
+        record['label'] = sensor_def['label']
+        record['unit'] = sensor_def['unit']
+        record['sample_count'] = 0
+
+        # Point location TODO: average, but for now assume static
+        if 'point' in record_in:
+            record['point'] = record_in['point']
+        else:
+            lon, lat = self.device.get_lon_lat(sensor_vals)
+            if lon and lat:
+                # Both lat and lon are valid!
+                record['point'] = 'SRID=4326;POINT(%f %f)' % (lon, lat)
+
+        # No 'point' proceeding without a location
+        if 'point' not in record:
+            # Only log warning once first time
+            reason = 'no GPS location'
+            if not self.has_err_msg(device_id, reason):
+                log.warn('id=%d-%d-%d-%s meta=%s gid_raw=%d: %s' % (
+                   device_id, day, hour, sensor_name, meta['device_meta'], gid_raw, reason))
+                self.add_err_msg(device_id, reason)
+            return None
+
+        # GPS height. TODO use air pressure
+        if 'altitude' in record_in:
+            record['altitude'] = record_in['altitude']
+        else:
+            record['altitude'] = 0
+            if 's_altimeter' in sensor_vals:
+                sensor_defs = self.device.get_sensor_defs()
+                altitude = sensor_defs['altitude']['converter'](sensor_vals['s_altimeter'])
+                valid, reason = self.device.check_value('altitude', sensor_vals, value=altitude)
+                if not valid:
+                    altitude = 0
+
+                # altitude valid!
+                record['altitude'] = altitude
+
+        return record
+
+    def finish_records(self, records_out, record_in):
+        # Values are float, all outputs should be ints, so round
+        for rec in records_out:
+            rec['value'] = int(round(rec['value']))
+            rec['value_raw'] = int(round(rec['value_raw']))
+            if 'last' in record_in:
+                rec.pop('sample_count')
+                rec.pop('value_min')
+                rec.pop('value_max')
+
+        return records_out
+
+    def refine(self, record_in, sensor_names):
+        # Start dict of output records, key is sensor name, value is a record
+        records_out = dict()
+
+        meta = self.get_meta(record_in)
+        gid_raw = meta['gid_raw']
+        day = meta['day']
+        hour = meta['hour']
+        device_id = meta['device_id']
+        device_meta = meta['device_meta']
+        unique_id = meta['unique_id']
 
         # ts_list (timeseries list) is an array of dict, each dict containing raw sensor values
         ts_list = record_in['data']['timeseries']
-        unique_id = 'device %d' % device_id
-        if 'unique_id' in record_in:
-            unique_id = record_in['unique_id']
 
         log.info('processing unique_id=%s gid_raw=%d ts_count=%d' % (unique_id, gid_raw, len(ts_list)))
 
         validate_errs = 0
-        sensor_defs = self.device.get_sensor_defs()
+        plan = self.get_plan(sensor_names)
 
         # Go through each record in timeseries list for single device
         for sensor_vals in ts_list:
-            # Go through all the configured sensor outputs we need to calc values for
-            for sensor_name in sensor_names:
+            # Go through all the sensor outputs in plan we need to calc values for
+            for entry in plan:
                 record = None
+                sensor_name = entry['name']
                 try:
-                    sensor_def = self.device.get_sensor_def(sensor_name)
-                    if not sensor_def:
-                        # log.warn('Sensor name %s not defined for device_meta=%s dev_id=%s' %
-                        #          (sensor_name, device_meta, str(device_id)))
-                        continue
-
-                    if 'input' not in sensor_def or 'converter' not in sensor_def:
-                        # Only log warning once first time
-                        reason = 'No input or converter defined for %s' % sensor_name
-                        if not self.has_err_msg(device_id, reason):
-                            log.warn('%s device_meta=%s dev_id=%s' %
-                                                             (reason, device_meta, str(device_id)))
-                            self.add_err_msg(device_id, reason)
-                        continue
+                    sensor_def = entry['def']
 
                     # In some cases the sensor_vals are unrelated to the sensor_name (mainly ASE)
-                    if not self.device.can_resolve(sensor_name, sensor_vals):
+                    if entry['resolver'] and not entry['resolver'](sensor_vals):
                         continue
 
                     # get raw input value(s)
                     # i.e. in some cases multiple inputs are required (e.g. audio bands)
-                    input_name = sensor_def['input']
+                    input_name = entry['input']
                     input_valid, reason = self.device.check_value(input_name, sensor_vals)
                     if not input_valid:
                         # Only log warning once first time (split off value details from 'reason' msg)
@@ -163,87 +291,13 @@ class Refiner:
                     if sensor_name not in records_out:
                         # Start new record with common data
                         # Subsequent data will be averaged.
-                        record = dict()
-
-                        # gid_raw refers to harvested record, optional
-                        if gid_raw > 0:
-                            record['gid_raw'] = gid_raw
-
-                        record['device_id'] = device_id
-                        record['device_meta'] = device_meta
-                        record['sensor_meta'] = self.device.get_sensor_meta_id(sensor_name, sensor_vals)
-
-                        if day > 0:
-                            # Refined timeseries table
-                            record['day'] = day
-                            record['hour'] = hour
-
-                            # GMT does not know about 24 so we move to 00:00 the next day
-                            day_hour = str(day) + str(hour)
-                            if hour == 24:
-                                # Need to move to 00:00 next day if hour is 24
-                                # Just incrementing the day +1 is not enough: we may need to skip to next month
-                                # http://stackoverflow.com/questions/3240458/how-to-increment-the-day-in-datetime-python
-                                next_day = datetime.strptime('%sGMT' % str(day), '%Y%m%dGMT').replace(tzinfo=pytz.utc)
-                                next_day += timedelta(days=1)
-                                day_hour = next_day.strftime('%Y%m%d') + '0'
-
-                            record['time'] = datetime.strptime('%sGMT' % day_hour, '%Y%m%d%HGMT').replace(tzinfo=pytz.utc)
-                        else:
-                            # For "last" values table
-
-                            # Optional fields dependent on input record
-                            if 'value_stale' in record_in:
-                                record['value_stale'] = record_in['value_stale']
-
-                            if 'device_name' in record_in:
-                                record['device_name'] = record_in['device_name']
-                                
-                            record['time'] = record_in['time']
-                            if 'unique_id' in record_in:
-                                record['unique_id'] = '%s-%s' % (str(record_in['unique_id']), sensor_name)
-                            else:
-                                record['unique_id'] = '%d-%s' % (device_id, sensor_name)
-
-                        record['name'] = sensor_name
-                        record['label'] = sensor_def['label']
-                        record['unit'] = sensor_def['unit']
-                        record['sample_count'] = 0
-
-                        # Point location TODO: average, but for now assume static
-                        if 'point' in record_in:
-                            record['point'] = record_in['point']
-                        else:
-                            lon, lat = self.device.get_lon_lat(sensor_vals)
-                            if lon and lat:
-                                # Both lat and lon are valid!
-                                record['point'] = 'SRID=4326;POINT(%f %f)' % (lon, lat)
+                        record = self.create_record(record_in, meta, sensor_name, sensor_def, sensor_vals)
 
                         # No 'point' proceeding without a location
-                        if 'point' not in record:
-                            # Only log warning once first time
-                            reason = 'no GPS location'
-                            if not self.has_err_msg(device_id, reason):
-                                log.warn('id=%d-%d-%d-%s meta=%s gid_raw=%d: %s' % (
-                                   device_id, day, hour, sensor_name, device_meta, gid_raw, reason))
-                                self.add_err_msg(device_id, reason)
+                        if record is None:
                             validate_errs += 1
                             continue
 
-                        # GPS height. TODO use air pressure
-                        if 'altitude' in record_in:
-                            record['altitude'] = record_in['altitude']
-                        else:
-                            record['altitude'] = 0
-                            if 's_altimeter' in sensor_vals:
-                                altitude = sensor_defs['altitude']['converter'](sensor_vals['s_altimeter'])
-                                valid, reason = self.device.check_value('altitude', sensor_vals, value=altitude)
-                                if not valid:
-                                    altitude = 0
-
-                                # altitude valid!
-                                record['altitude'] = altitude
-
                     else:
                         # Record for sensor_name already exists: will add to average later
                         record = records_out[sensor_name]
@@ -259,7 +313,7 @@ class Refiner:
                         # Here M is the (cumulative moving) average, x is the new value in the
                         # sequence, n is the count of values.
                         record['value_raw'] = self.moving_average(value_raw_avg, value_raw, record['sample_count'],
-                                                                  sensor_defs[input_name_0]['unit'])
+                                                                  entry['input_units'][input_name_0])
                     else:
                         # First value for avg
                         record['value_raw'] = value_raw
@@ -271,8 +325,12 @@ class Refiner:
 
                     # 1) check inputs
                     sensor_vals['device_id'] = device_id
-                    value = sensor_def['converter'](value_raw, sensor_vals, sensor_def, self.device)
+                    value = entry['converter'](value_raw, sensor_vals, sensor_def, self.device)
                     output_valid, reason = self.device.check_value(sensor_name, sensor_vals, value=value)
+                    if value is None:
+                        # Converter may leave a (partial) value in the sample, never average None
+                        output_valid, reason = False, '%s is None' % sensor_name
+
                     if not output_valid:
                         reason_msg = reason.split(':')[0]
                         if not self.has_err_msg(device_id, reason_msg):
@@ -289,7 +347,7 @@ class Refiner:
                     # Finally calculate calibrated value and recalc  average
                     if value_avg is not None:
                         # Recalc avg
-                        record['value'] = self.moving_average(value_avg, value, record['sample_count'], sensor_def['unit'])
+                        record['value'] = self.moving_average(value_avg, value, record['sample_count'], entry['unit'])
 
                         # Set min/max
                         if value < record['value_min']:
@@ -316,16 +374,250 @@ class Refiner:
                         #     record['value_raw'] = sensor_vals['v_audioavg']
 
         # make records into a list() and round all (raw) values
-        records_out = records_out.values()
-
-        # Values are float, all outputs should be ints, so round
-        for rec in records_out:
-            rec['value'] = int(round(rec['value']))
-            rec['value_raw'] = int(round(rec['value_raw']))
-            if 'last' in record_in:
-                rec.pop('sample_count')
-                rec.pop('value_min')
-                rec.pop('value_max')
+        records_out = self.finish_records(records_out.values(), record_in)
 
         log.info('Result unique_id=%s gid_raw=%d record_count=%d val_errs=%d' % (unique_id, gid_raw, len(records_out), validate_errs))
         return records_out
+
+    # Cumulative moving average over all values at once, columnar equivalent of moving_average().
+    # counts holds n (sample_count) for each value, M = M + (x-M)/n unrolled:
+    # each x contributes x/n times (1 - 1/n') for all subsequent n'.
+    def moving_average_column(self, values, counts, unit):
+        if 'dB' in unit:
+            # Average "real" (power 10) values and convert back to Decibel
+            avg = self.moving_average_column(numpy.power(10.0, values / 10.0), counts, 'int')
+            return math.log10(avg) * 10.0
+
+        weights = 1.0 / counts
+        decay = numpy.ones(len(values))
+        decay[:-1] = numpy.cumprod((1.0 - weights)[:0:-1])[::-1]
+        return float(numpy.sum(values * weights * decay))
+
+    def refine_columnar(self, record_in, sensor_names):
+        """
+        Refine raw (hour) record per sensor over all samples (columns) at once
+        using NumPy for input checks, conversions and averaging. Gives the same
+        results as refine() for Devices that support this, otherwise falls back to refine().
+        """
+        if not self.device.supports_columnar():
+            return self.refine(record_in, sensor_names)
+
+        records_out = list()
+        meta = self.get_meta(record_in)
+        gid_raw = meta['gid_raw']
+        device_id = meta['device_id']
+        ts_list = record_in['data']['timeseries']
+
+        log.info('processing columnar unique_id=%s gid_raw=%d ts_count=%d' % (meta['unique_id'], gid_raw, len(ts_list)))
+
+        validate_errs = 0
+        columns = SampleColumns(ts_list)
+        for entry in self.get_plan(sensor_names):
+            try:
+                record, errs = self.refine_column(record_in, meta, entry, columns)
+            except Exception as e:
+                log.error('Exception refining %s gid_raw=%d dev=%d day-hour=%d-%d, err=%s' % (
+                    entry['name'], gid_raw, device_id, meta['day'], meta['hour'], str(e)))
+                traceback.print_exc(file=sys.stdout)
+                continue
+
+            validate_errs += errs
+            if record and 'value' in record:
+                records_out.append(record)
+
+        records_out = self.finish_records(records_out, record_in)
+
+        log.info('Result unique_id=%s gid_raw=%d record_count=%d val_errs=%d' % (meta['unique_id'], gid_raw, len(records_out), validate_errs))
+        return records_out
+
+    def refine_column(self, record_in, meta, entry, columns):
+        """
+        Refine single sensor (SensorPlan entry) over all samples.
+        :return: tuple of (record or None, validation error count)
+        """
+        device_id = meta['device_id']
+        day = meta['day']
+        hour = meta['hour']
+        gid_raw = meta['gid_raw']
+        ts_list = columns.val_dicts
+        sensor_name = entry['name']
+        sensor_def = entry['def']
+
+        # Devices supporting columnar mode resolve sensors independent of sample
+        if len(ts_list) == 0 or (entry['resolver'] and not entry['resolver'](ts_list[0])):
+            return None, 0
+
+        # 1) check inputs (available and valid) for all samples
+        input_name = entry['input']
+        input_valid = self.device.check_column(input_name, columns)
+        value_raw, input_name_0 = self.device.get_raw_column(input_name, columns)
+        validate_errs = int(numpy.count_nonzero(~input_valid))
+        if validate_errs > 0:
+            # Only log warning once first time, reason from first invalid sample
+            sensor_vals = ts_list[int(numpy.argmin(input_valid))]
+            input_ok, reason = self.device.check_value(input_name, sensor_vals)
+            reason_msg = reason.split(':')[0]
+            if not self.has_err_msg(device_id, reason_msg):
+                log.warn('id=%d-%d-%d-%s meta=%s gid_raw=%d: invalid input for %s: detail=%s' % (
+                    device_id, day, hour, sensor_name, meta['device_meta'], gid_raw, str(input_name), reason))
+                self.add_err_msg(device_id, reason_msg)
+
+        # No use to proceed without raw input value(s)
+        candidates = input_valid & ~numpy.isnan(value_raw)
+        validate_errs += int(numpy.count_nonzero(input_valid & numpy.isnan(value_raw)))
+        indexes = numpy.flatnonzero(candidates)
+
+        # 2) convert and 3) check output (available and valid)
+        # output_valid: per candidate, values: converted value per valid candidate
+        record = None
+        start = len(indexes)
+        converter = entry['converter']
+        column_func = getattr(converter, 'column_func', None)
+        if column_func:
+            values = column_func(value_raw[indexes])
+            output_valid = self.check_values_logged(meta, sensor_name, values, ts_list, indexes)
+
+            # Record starts at first sample with location and valid output
+            for pos, index in enumerate(indexes):
+                record = self.create_record(record_in, meta, sensor_name, sensor_def, ts_list[index])
+                if record is not None and output_valid[pos]:
+                    start = pos
+                    break
+                record = None
+
+            output_valid = output_valid[start:]
+            validate_errs += start + int(numpy.count_nonzero(~output_valid))
+            values = values[start:][output_valid].tolist()
+        else:
+            output_valid = list()
+            values = list()
+            pos = 0
+
+            # Until start sample by sample: record starts at first sample with location and valid output
+            while record is None and pos < len(indexes):
+                sensor_vals = ts_list[indexes[pos]]
+                pos += 1
+                record = self.create_record(record_in, meta, sensor_name, sensor_def, sensor_vals)
+                if record is None:
+                    validate_errs += 1
+                    continue
+
+                results, errs = self.convert_samples(meta, entry, [sensor_vals])
+                validate_errs += errs
+                value, valid = results[0]
+                if not valid:
+                    record = None
+                    continue
+
+                start = pos - 1
+                output_valid.append(True)
+                values.append(value)
+
+            # From start all remaining samples at once (batch converter if available)
+            if record is not None and pos < len(indexes):
+                results, errs = self.convert_samples(meta, entry, [ts_list[index] for index in indexes[pos:]])
+                validate_errs += errs
+                for value, valid in results:
+                    output_valid.append(valid)
+                    if valid:
+                        values.append(value)
+
+            output_valid = numpy.array(output_valid, dtype=bool)
+
+            # Scalar converters may have added or changed values in the samples
+            columns.invalidate()
+
+        if record is None:
+            return None, validate_errs
+
+        # Calculate values, also keep raw value, min and max
+        # All samples with valid input from start count, also with invalid output
+        indexes = indexes[start:]
+        counts = numpy.arange(1, len(indexes) + 1, dtype=float)
+        record['sample_count'] = len(indexes)
+        record['value_raw'] = self.moving_average_column(value_raw[indexes], counts,
+                                                         entry['input_units'][input_name_0])
+
+        record['value'] = self.moving_average_column(numpy.array(values, dtype=float), counts[output_valid],
+                                                     entry['unit'])
+        record['value_min'] = min(values)
+        record['value_max'] = max(values)
+
+        # Some Devices need (last) values from other records where not all values are in same record
+        last_index = indexes[output_valid][-1]
+        self.device.set_last_value(device_id, sensor_name, values[-1], ts_list[last_index])
+
+        return record, validate_errs
+
+    def convert_samples(self, meta, entry, samples):
+        """
+        Convert and check output for samples (dicts) in sample order, using the batch variant
+        of the converter when available.
+        :return: tuple of (list of (value, valid) tuples, validation error count)
+        """
+        device_id = meta['device_id']
+        sensor_name = entry['name']
+        sensor_def = entry['def']
+        converter = entry['converter']
+
+        inputs = list()
+        for sensor_vals in samples:
+            sensor_vals['device_id'] = device_id
+            value_raw, input_name_0 = self.device.get_raw_value(entry['input'], sensor_vals)
+            inputs.append(value_raw)
+
+        batch_func = getattr(converter, 'batch_func', None)
+        if batch_func:
+            converted = batch_func(inputs, samples, sensor_def, self.device)
+        else:
+            converted = list()
+            for value_raw, sensor_vals in zip(inputs, samples):
+                try:
+                    converted.append((converter(value_raw, sensor_vals, sensor_def, self.device), None))
+                except Exception as e:
+                    traceback.print_exc(file=sys.stdout)
+                    converted.append((None, e))
+
+        results = list()
+        validate_errs = 0
+        for (value, error), sensor_vals in zip(converted, samples):
+            if error is not None:
+                # Sample counts (once started) but without value
+                log.error('Exception refining %s gid_raw=%d dev=%d day-hour=%d-%d, err=%s' % (
+                    sensor_name, meta['gid_raw'], device_id, meta['day'], meta['hour'], str(error)))
+                results.append((None, False))
+                continue
+
+            valid, reason = self.device.check_value(sensor_name, sensor_vals, value=value)
+            if value is None:
+                # Converter may leave a (partial) value in the sample, never average None
+                valid, reason = False, '%s is None' % sensor_name
+
+            if not valid:
+                reason_msg = reason.split(':')[0]
+                if not self.has_err_msg(device_id, reason_msg):
+                    log.warn('id=%d-%d-%d-%s gid_raw=%d: invalid output for %s: detail=%s' % (
+                        device_id, meta['day'], meta['hour'], sensor_name, meta['gid_raw'], sensor_name, reason))
+                    self.add_err_msg(device_id, reason_msg)
+                validate_errs += 1
+
+            results.append((value, valid))
+
+        return results, validate_errs
+
+    def check_values_logged(self, meta, sensor_name, values, ts_list, indexes):
+        # Check output column, log reason once for first invalid value
+        output_valid = self.device.check_values(sensor_name, values)
+        if not output_valid.all():
+            device_id = meta['device_id']
+            pos = int(numpy.argmin(output_valid))
+            value = values[pos]
+            valid, reason = self.device.check_value(sensor_name, ts_list[indexes[pos]],
+                                                    value=None if numpy.isnan(value) else value.item())
+            reason_msg = reason.split(':')[0]
+            if not self.has_err_msg(device_id, reason_msg):
+                log.warn('id=%d-%d-%d-%s gid_raw=%d: invalid output for %s: detail=%s' % (
+                    device_id, meta['day'], meta['hour'], sensor_name, meta['gid_raw'], sensor_name, reason))
+                self.add_err_msg(device_id, reason_msg)
+
+        return output_valid
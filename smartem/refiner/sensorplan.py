@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Sensor plan: the Sensor Defs of a Device resolved once for a list of output sensor names.
+#
+
+# Author: Just van den Broecke - 2015-2019
+
+import logging
+
+log = logging.getLogger('SensorPlan')
+
+
+class SensorPlan:
+    """
+    Sensor definitions of a Device resolved once for the output sensor names of a Refiner.
+    Each entry is a dict with the sensor name, its Sensor Def, input(s), converter,
+    units and an optional resolver function. Sensors that cannot be refined (no Sensor Def,
+    no input or no converter) are dropped. Entries are ordered such that sensors
+    that take another output sensor as input come after that sensor.
+    """
+
+    def __init__(self, device, sensor_names):
+        self.device = device
+        self.sensor_names = sensor_names
+        self.entries = list()
+
+        sensor_defs = device.get_sensor_defs()
+        for sensor_name in sensor_names:
+            sensor_def = device.get_sensor_def(sensor_name)
+            if not sensor_def:
+                continue
+
+            if 'input' not in sensor_def or 'converter' not in sensor_def:
+                log.warn('No input or converter defined for %s device_type=%s: skipped' %
+                         (sensor_name, device.get_type()))
+                continue
+
+            input_name = sensor_def['input']
+            input_names = input_name
+            if type(input_names) is not list:
+                input_names = [input_names]
+
+            # Units of raw inputs, the raw input actually used may differ per sample
+            input_units = dict()
+            for name in input_names:
+                if name in sensor_defs and 'unit' in sensor_defs[name]:
+                    input_units[name] = sensor_defs[name]['unit']
+
+            self.entries.append({
+                'name': sensor_name,
+                'def': sensor_def,
+                'input': input_name,
+                'input_names': input_names,
+                'input_units': input_units,
+                'converter': sensor_def['converter'],
+                'unit': sensor_def['unit'],
+                'resolver': device.get_resolver(sensor_name)
+            })
+
+        self.entries = self.order_entries(self.entries)
+        log.info('Sensor plan device_type=%s: %s' % (device.get_type(), str(self.get_names())))
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_names(self):
+        return [entry['name'] for entry in self.entries]
+
+    @staticmethod
+    def order_entries(entries):
+        # Stable ordering: an entry comes after the entries producing its inputs
+        # (e.g. noiselevelavg takes noiseavg as input).
+        names = [entry['name'] for entry in entries]
+        ordered = list()
+        placed = set()
+        pending = list(entries)
+        while pending:
+            progress = False
+            for entry in list(pending):
+                deps = [n for n in entry['input_names'] if n in names and n != entry['name']]
+                if all(n in placed for n in deps):
+                    ordered.append(entry)
+                    placed.add(entry['name'])
+                    pending.remove(entry)
+                    progress = True
+                    break
+
+            if not progress:
+                # Circular inputs: keep configured order
+                ordered.extend(pending)
+                break
+
+        return ordered
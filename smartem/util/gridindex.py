@@ -0,0 +1,40 @@
+import math
+
+
+class BBoxGridIndex:
+
+    def __init__(self, bboxes, cell_size=0.1):
+        """
+        Uniform grid index over named bboxes for fast point-in-bbox lookup:
+        each grid cell lists the bboxes overlapping it, such that a point
+        is only tested against the bboxes of its cell.
+
+        :param bboxes: dict of name to bbox [lower lat, lower lon, upper lat, upper lon]
+        :param cell_size: grid cell size in degrees
+        """
+        self.cell_size = float(cell_size)
+        self.cells = dict()
+        for name, bbox in sorted(bboxes.items()):
+            bbox = [float(c) for c in bbox]
+            lat_min, lon_min = self.cell(bbox[0], bbox[1])
+            lat_max, lon_max = self.cell(bbox[2], bbox[3])
+            for lat_cell in range(lat_min, lat_max + 1):
+                for lon_cell in range(lon_min, lon_max + 1):
+                    self.cells.setdefault((lat_cell, lon_cell), []).append((name, bbox))
+
+    def cell(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size))
+
+    def lookup(self, latitude, longitude):
+        """
+        Get names of bboxes containing point (borders excluded).
+
+        :param latitude:
+        :param longitude:
+        :return: list of bbox names, sorted, empty if none
+        """
+        return [name for name, bbox in self.cells.get(self.cell(latitude, longitude), [])
+                if bbox[0] < latitude < bbox[2] and bbox[1] < longitude < bbox[3]]
+
+    def __repr__(self):
+        return "BBoxGridIndex(cell_size=%.3f,cells=%d)" % (self.cell_size, len(self.cells))
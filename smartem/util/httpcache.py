@@ -0,0 +1,53 @@
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger('HttpCache')
+
+
+class HttpCache:
+
+    def __init__(self, db_file):
+        """
+        Persistent cache of HTTP responses in SQLite: body with validators
+        (ETag, Last-Modified) for conditional GET, or marked immutable
+        to never fetch again. Thread-safe.
+
+        :param db_file: SQLite database file
+        """
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS http_cache ('
+                                'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                                'immutable INTEGER, body BLOB, fetch_time REAL)')
+        self.hits = 0
+        self.validated = 0
+        self.misses = 0
+
+    def get(self, url):
+        """
+        Get cached response.
+
+        :param url: the URL
+        :return: dict with etag, last_modified, immutable, body or None if not cached
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT etag, last_modified, immutable, body FROM http_cache WHERE url=?',
+                                          (url,)).fetchone()
+        if row is None:
+            return None
+
+        return {'etag': row[0], 'last_modified': row[1], 'immutable': bool(row[2]), 'body': str(row[3])}
+
+    def put(self, url, body, etag=None, last_modified=None, immutable=False):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?)',
+                                    (url, etag, last_modified, int(immutable), sqlite3.Binary(body), time.time()))
+
+    def close(self):
+        log.info('HTTP cache %s: %d hits, %d validated (304), %d misses' %
+                 (self.db_file, self.hits, self.validated, self.misses))
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,69 @@
+import json
+import re
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_array_items(fileobj, chunk_size=64 * 1024):
+    """
+    Generate the items of a top-level JSON array read incrementally from a file object.
+    Each item is decoded by the (C-accelerated) json decoder as soon as it is complete
+    in the buffer, only the current item and one chunk are kept in memory.
+
+    :param fileobj: file-like object with read(size), e.g. HTTP response
+    :param chunk_size: bytes per read
+    :return: generator of decoded items
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    need_more = False
+
+    # start: expect '[', first: first item or ']', item: item, next: ',' or ']'
+    state = 'start'
+    while True:
+        pos = WHITESPACE_RE.match(buf, pos).end()
+        if pos == len(buf) or need_more:
+            if eof:
+                raise ValueError('Unterminated JSON array')
+
+            chunk = fileobj.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            need_more = False
+            continue
+
+        char = buf[pos]
+        if state == 'start':
+            if char != '[':
+                raise ValueError('Not a JSON array at "%s"' % buf[pos:pos + 20])
+            pos += 1
+            state = 'first'
+        elif state in ['first', 'next'] and char == ']':
+            return
+        elif state == 'next':
+            if char != ',':
+                raise ValueError('Expecting , or ] at "%s"' % buf[pos:pos + 20])
+            pos += 1
+            state = 'item'
+        else:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Item incomplete in buffer, or invalid
+                if eof:
+                    raise
+                need_more = True
+                continue
+
+            # Complete when followed by separator, a number may continue in next chunk
+            after = WHITESPACE_RE.match(buf, end).end()
+            if not eof and (after == len(buf) or buf[after] not in ',]'):
+                need_more = True
+                continue
+
+            yield item
+            pos = end
+            state = 'next'
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    def __init__(self, max_size):
+        """
+        Bounded cache, least recently used entries are evicted first.
+        Counts hits and misses.
+
+        :param max_size: maximum number of entries
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Get cached value
+
+        :param key: hashable key
+        :return: the value or None if not cached
+        """
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+
+        # Re-insert as most recently used
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "LRUCache(size=%d,max_size=%d,hits=%d,misses=%d)" % \
+               (len(self.entries), self.max_size, self.hits, self.misses)
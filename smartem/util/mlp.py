@@ -0,0 +1,105 @@
+import numpy
+
+
+class NumpyMLP(dict):
+
+    ACTIVATIONS = {
+        'identity': lambda x: x,
+        'logistic': lambda x: 1.0 / (1.0 + numpy.exp(-x)),
+        'tanh': numpy.tanh,
+        'relu': lambda x: numpy.maximum(x, 0)
+    }
+
+    def __init__(self, mean, scale, coefs, intercepts, activation,
+                 out_activation='identity', **kwargs):
+        """
+        Forward pass of a scaled MLP regressor (sklearn Pipeline of
+        StandardScaler and MLPRegressor) using NumPy only.
+        The dict contents (lists) are the compact (JSON) model format.
+
+        :param mean: scaler mean per input
+        :param scale: scaler scale per input
+        :param coefs: weight matrix per layer
+        :param intercepts: bias vector per layer
+        :param activation: hidden layer activation: identity, logistic, tanh or relu
+        :param out_activation: output layer activation
+        """
+        super(NumpyMLP, self).__init__(**kwargs)
+        self['mean'] = list(mean)
+        self['scale'] = list(scale)
+        self['coefs'] = [numpy.asarray(coef).tolist() for coef in coefs]
+        self['intercepts'] = [numpy.asarray(intercept).tolist() for intercept in intercepts]
+        self['activation'] = activation
+        self['out_activation'] = out_activation
+
+        if activation not in NumpyMLP.ACTIVATIONS or out_activation not in NumpyMLP.ACTIVATIONS:
+            raise ValueError('Unsupported activation %s or %s' % (activation, out_activation))
+
+        self.mean = numpy.array(self['mean'], dtype=float)
+        self.scale = numpy.array(self['scale'], dtype=float)
+        self.coefs = [numpy.array(coef, dtype=float) for coef in self['coefs']]
+        self.intercepts = [numpy.array(intercept, dtype=float) for intercept in self['intercepts']]
+
+    def predict(self, x):
+        """
+        Predict values for rows of inputs
+
+        :param x: 2D array-like (n_samples x n_inputs)
+        :return: 1D array of predicted values (n_samples)
+        :raises ValueError: if inputs contain None, NaN or infinity (as sklearn)
+        """
+        x = numpy.asarray(x, dtype=float)
+        if not numpy.all(numpy.isfinite(x)):
+            raise ValueError('Input contains NaN, infinity or a value too large for dtype float64.')
+
+        activations = (x - self.mean) / self.scale
+        hidden_activation = NumpyMLP.ACTIVATIONS[self['activation']]
+        last = len(self.coefs) - 1
+        for i in range(len(self.coefs)):
+            activations = numpy.dot(activations, self.coefs[i]) + self.intercepts[i]
+            if i < last:
+                activations = hidden_activation(activations)
+
+        activations = NumpyMLP.ACTIVATIONS[self['out_activation']](activations)
+        if activations.shape[1] == 1:
+            activations = activations.ravel()
+
+        return activations
+
+    def __repr__(self):
+        return "NumpyMLP(layers=%s,activation=%s)" % \
+               (str([len(intercept) for intercept in self['intercepts']]), self['activation'])
+
+    @staticmethod
+    def from_dict(d):
+        for key in ['mean', 'scale', 'coefs', 'intercepts', 'activation']:
+            if key not in d:
+                raise ValueError('%s not specified in dict' % key)
+        return NumpyMLP(d['mean'], d['scale'], d['coefs'], d['intercepts'], d['activation'],
+                        d.get('out_activation', 'identity'))
+
+    @staticmethod
+    def from_pipeline(pipeline):
+        """
+        Export fitted sklearn Pipeline of StandardScaler and MLPRegressor
+        (as made by the Calibrator) to NumpyMLP.
+
+        :param pipeline: fitted Pipeline
+        :return: NumpyMLP
+        """
+        scaler = pipeline.steps[0][1]
+        mlp = pipeline.steps[-1][1]
+        if len(pipeline.steps) != 2 or not hasattr(scaler, 'scale_') or not hasattr(mlp, 'coefs_'):
+            raise ValueError('Pipeline is not a fitted StandardScaler and MLPRegressor')
+
+        n_inputs = mlp.coefs_[0].shape[0]
+        mean = numpy.zeros(n_inputs)
+        scale = numpy.ones(n_inputs)
+        if scaler.with_mean:
+            mean = scaler.mean_
+        if scaler.with_std:
+            scale = scaler.scale_
+
+        return NumpyMLP(numpy.asarray(mean).tolist(), numpy.asarray(scale).tolist(),
+                        mlp.coefs_, mlp.intercepts_, mlp.activation,
+                        getattr(mlp, 'out_activation_', 'identity'))
@@ -0,0 +1,173 @@
+import logging
+import os
+import time
+
+log = logging.getLogger('Spool')
+
+
+class Spool:
+
+    def __init__(self, spool_dir, segment_bytes=16 * 1024 * 1024, segment_age=3600,
+                 max_bytes=1024 * 1024 * 1024, max_age=7 * 24 * 3600, fsync_batches=10):
+        """
+        Durable on-disk spool (write-ahead buffer) for text batches (payloads).
+        Batches are appended to segment files, replayed in order and acknowledged:
+        the acknowledged position is kept in an 'ack' file and fully acknowledged
+        segments are deleted. Segments roll over by size and age, the oldest segments are
+        dropped when the spool exceeds max_bytes or max_age.
+
+        :param spool_dir: directory for segment files
+        :param segment_bytes: max bytes per segment
+        :param segment_age: max seconds to append to a segment
+        :param max_bytes: max bytes of all segments
+        :param max_age: max seconds to keep a segment
+        :param fsync_batches: fsync after this number of appended batches
+        """
+        self.spool_dir = spool_dir
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_batches = fsync_batches
+
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+
+        self.segments = sorted([int(name[8:-3]) for name in os.listdir(spool_dir)
+                                if name.startswith('segment-') and name.endswith('.lp')])
+        self.ack_seq, self.ack_offset = self.read_ack()
+        self.current = None
+        self.current_time = 0
+        self.unsynced = 0
+        self.enforce_caps()
+
+        if self.has_pending():
+            log.info('Spool %s: %d segments pending' % (spool_dir, len(self.segments)))
+
+    def segment_path(self, seq):
+        return os.path.join(self.spool_dir, 'segment-%010d.lp' % seq)
+
+    def read_ack(self):
+        try:
+            with open(os.path.join(self.spool_dir, 'ack')) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (IOError, OSError, ValueError):
+            return 0, 0
+
+    def write_ack(self, seq, offset):
+        # Atomic replace of ack file
+        self.ack_seq, self.ack_offset = seq, offset
+        path = os.path.join(self.spool_dir, 'ack')
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d\n' % (seq, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+
+    def has_pending(self):
+        return len(self.segments) > 0
+
+    def append(self, payload):
+        """
+        Append batch to current segment, fsync per fsync_batches.
+        """
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+
+        if self.current is None or self.current.tell() >= self.segment_bytes or \
+                time.time() - self.current_time >= self.segment_age:
+            self.roll()
+
+        self.current.write('%d\n' % len(payload))
+        self.current.write(payload)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_batches:
+            self.sync()
+
+        self.enforce_caps()
+
+    def sync(self):
+        if self.current is not None and self.unsynced > 0:
+            self.current.flush()
+            os.fsync(self.current.fileno())
+            self.unsynced = 0
+
+    def roll(self):
+        # Start new segment
+        self.close()
+        seq = max(self.segments + [self.ack_seq - 1]) + 1
+        self.current = open(self.segment_path(seq), 'ab')
+        self.current_time = time.time()
+        self.segments.append(seq)
+
+    def close(self):
+        if self.current is not None:
+            self.sync()
+            self.current.close()
+            self.current = None
+
+    def drop_segment(self, seq):
+        if self.current is not None and seq == self.segments[-1]:
+            self.close()
+
+        os.remove(self.segment_path(seq))
+        self.segments.remove(seq)
+
+    def enforce_caps(self):
+        # Drop oldest segments exceeding max_bytes or max_age
+        now = time.time()
+        sizes = dict([(seq, os.path.getsize(self.segment_path(seq))) for seq in self.segments])
+        total = sum(sizes.values())
+        for seq in list(self.segments):
+            age = now - os.path.getmtime(self.segment_path(seq))
+            if total <= self.max_bytes and age <= self.max_age:
+                break
+
+            log.warn('Spool %s: dropping segment %d (%d bytes, %d secs old)' % (self.spool_dir, seq, sizes[seq], age))
+            self.drop_segment(seq)
+            total -= sizes[seq]
+
+    def replay(self, post):
+        """
+        Replay pending batches in order until post fails.
+
+        :param post: function(payload) returning True when delivered
+        :return: True if all pending batches were delivered
+        """
+        # New appends go to a new segment
+        self.close()
+        count = 0
+        while len(self.segments) > 0:
+            seq = self.segments[0]
+            offset = 0
+            if seq == self.ack_seq:
+                offset = self.ack_offset
+
+            with open(self.segment_path(seq), 'rb') as f:
+                f.seek(offset)
+                while True:
+                    header = f.readline()
+                    try:
+                        size = int(header)
+                    except ValueError:
+                        # End of segment or incomplete (torn) write
+                        break
+
+                    payload = f.read(size)
+                    if len(payload) < size:
+                        break
+
+                    if not post(payload):
+                        log.info('Spool %s: replayed %d batches, stopped at segment %d' % (self.spool_dir, count, seq))
+                        return False
+
+                    count += 1
+                    self.write_ack(seq, f.tell())
+
+            # Segment fully acknowledged
+            self.drop_segment(seq)
+            self.write_ack(seq + 1, 0)
+
+        log.info('Spool %s: replayed %d batches' % (self.spool_dir, count))
+        return True
@@ -0,0 +1,44 @@
+import threading
+import time
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        """
+        Thread-safe token bucket rate limiter: tokens are added at rate
+        per second up to capacity, each request takes a token.
+
+        :param rate: tokens (requests) per second
+        :param capacity: max tokens (burst), default max(1, rate)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.last_time = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Take tokens, wait until available.
+
+        :param tokens: number of tokens
+        :return: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+                self.last_time = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def __repr__(self):
+        return "TokenBucket(rate=%.2f,capacity=%.2f)" % (self.rate, self.capacity)
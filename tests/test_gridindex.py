@@ -0,0 +1,68 @@
+import random
+import unittest
+
+from smartem.util.gridindex import BBoxGridIndex
+
+BBOXES = {
+    'Nijmegen': [51.7, 5.6, 51.9, 6.0],
+    'Amsterdam': [52.3, 4.7, 52.5, 5.1],
+    'Gelderland': [51.7, 5.1, 52.5, 6.8],
+    'Small': [51.81, 5.81, 51.82, 5.82],
+    'South': [-34.0, -58.5, -33.5, -58.0]
+}
+
+
+def brute_force(bboxes, latitude, longitude):
+    return sorted([name for name, bbox in bboxes.items()
+                   if bbox[0] < latitude < bbox[2] and bbox[1] < longitude < bbox[3]])
+
+
+class BBoxGridIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BBoxGridIndex(BBOXES)
+
+    def test_inside(self):
+        self.assertEqual(self.index.lookup(51.85, 5.85), ['Gelderland', 'Nijmegen'])
+        self.assertEqual(self.index.lookup(51.815, 5.815), ['Gelderland', 'Nijmegen', 'Small'])
+        self.assertEqual(self.index.lookup(52.4, 4.9), ['Amsterdam'])
+        self.assertEqual(self.index.lookup(-33.7, -58.2), ['South'])
+
+    def test_outside(self):
+        self.assertEqual(self.index.lookup(0.0, 0.0), [])
+        self.assertEqual(self.index.lookup(48.85, 2.35), [])
+
+    def test_bbox_edges_excluded(self):
+        # As the bbox test in assemble(): borders are outside
+        self.assertEqual(self.index.lookup(51.7, 5.8), [])
+        self.assertEqual(self.index.lookup(51.9, 5.8), ['Gelderland'])
+        self.assertEqual(self.index.lookup(51.8, 5.6), ['Gelderland'])
+        self.assertEqual(self.index.lookup(51.8, 6.0), ['Gelderland'])
+
+    def test_cell_borders(self):
+        # Points on grid lines (multiples of cell size) within bboxes
+        self.assertEqual(self.index.lookup(51.8, 5.8), ['Gelderland', 'Nijmegen'])
+        self.assertEqual(self.index.lookup(52.4, 5.0), ['Amsterdam'])
+        self.assertEqual(self.index.lookup(52.4, 6.0), ['Gelderland'])
+        self.assertEqual(self.index.lookup(-33.9, -58.1), ['South'])
+
+    def test_same_as_brute_force(self):
+        random.seed(1)
+        for i in range(20000):
+            latitude = round(random.uniform(-35.0, 53.0), random.choice([1, 2, 4]))
+            longitude = round(random.uniform(-59.0, 7.0), random.choice([1, 2, 4]))
+            self.assertEqual(self.index.lookup(latitude, longitude), brute_force(BBOXES, latitude, longitude),
+                             'lat=%s lon=%s' % (latitude, longitude))
+
+    def test_cell_sizes(self):
+        for cell_size in [0.01, 0.25, 1.0, 10.0]:
+            index = BBoxGridIndex(BBOXES, cell_size)
+            for latitude, longitude in [(51.85, 5.85), (51.7, 5.8), (52.4, 5.0), (-33.7, -58.2)]:
+                self.assertEqual(index.lookup(latitude, longitude), brute_force(BBOXES, latitude, longitude))
+
+    def test_empty(self):
+        self.assertEqual(BBoxGridIndex({}).lookup(51.85, 5.85), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+from urllib2 import HTTPError
+
+from smartem.util.httpcache import HttpCache
+
+try:
+    from smartem import rawsensorapi
+except ImportError:
+    # Stetl not installed
+    rawsensorapi = None
+
+BASE_URL = 'http://whale/sensors/v1'
+
+# Hours listing of day long ago: immutable, of today: not immutable
+OLD_DAY_URL = BASE_URL + '/devices/1/timeseries/20190101'
+DEVICES_URL = BASE_URL + '/devices'
+
+
+class HttpCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'http_cache.db')
+        self.cache = HttpCache(self.db_file)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_miss(self):
+        self.assertEqual(self.cache.get(DEVICES_URL), None)
+
+    def test_put_get(self):
+        self.cache.put(DEVICES_URL, '{"devices": []}', '"abc"', 'Tue, 01 Jan 2019 00:00:00 GMT')
+        self.assertEqual(self.cache.get(DEVICES_URL), {
+            'etag': '"abc"',
+            'last_modified': 'Tue, 01 Jan 2019 00:00:00 GMT',
+            'immutable': False,
+            'body': '{"devices": []}'
+        })
+
+    def test_replace(self):
+        self.cache.put(OLD_DAY_URL, 'old', '"1"')
+        self.cache.put(OLD_DAY_URL, 'new', None, None, True)
+        entry = self.cache.get(OLD_DAY_URL)
+        self.assertEqual(entry['body'], 'new')
+        self.assertEqual(entry['etag'], None)
+        self.assertTrue(entry['immutable'])
+
+    def test_persistent(self):
+        self.cache.put(OLD_DAY_URL, 'body', None, None, True)
+        self.cache.close()
+        self.cache = HttpCache(self.db_file)
+        self.assertEqual(self.cache.get(OLD_DAY_URL)['body'], 'body')
+
+
+class FakeResponse:
+
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+
+    def read(self):
+        return self.body
+
+    def info(self):
+        return self.headers
+
+
+@unittest.skipIf(rawsensorapi is None, 'Stetl not installed')
+class RawSensorAPICacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.requests = []
+        self.responses = []
+
+        # Input without config: only the attributes used by read_from_url()
+        self.api_input = rawsensorapi.RawSensorAPIInput.__new__(rawsensorapi.RawSensorAPIInput)
+        self.api_input.base_url = BASE_URL
+        self.api_input.auth = None
+        self.api_input.rate_limiter = None
+        self.api_input.http_cache = HttpCache(os.path.join(self.tmp_dir, 'http_cache.db'))
+
+        self.urlopen = rawsensorapi.urlopen
+        rawsensorapi.urlopen = self.fake_urlopen
+
+    def tearDown(self):
+        rawsensorapi.urlopen = self.urlopen
+        self.api_input.http_cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def fake_urlopen(self, request):
+        self.requests.append(request)
+        response = self.responses.pop(0)
+        if response == 304:
+            raise HTTPError(request.get_full_url(), 304, 'Not Modified', {}, None)
+        return response
+
+    def test_cacheable(self):
+        self.assertTrue(self.api_input.is_cacheable(DEVICES_URL))
+        self.assertTrue(self.api_input.is_cacheable(BASE_URL + '/devices/1/timeseries'))
+        self.assertTrue(self.api_input.is_cacheable(OLD_DAY_URL))
+        self.assertFalse(self.api_input.is_cacheable(OLD_DAY_URL + '/3'))
+        self.assertFalse(self.api_input.is_cacheable(BASE_URL + '/devices/1/last'))
+
+    def test_immutable(self):
+        self.assertTrue(self.api_input.is_immutable(OLD_DAY_URL))
+        self.assertFalse(self.api_input.is_immutable(BASE_URL + '/devices/1/timeseries/29990101'))
+        self.assertFalse(self.api_input.is_immutable(DEVICES_URL))
+
+    def test_revalidate_not_modified(self):
+        self.responses = [FakeResponse('{"devices": ["1"]}', {'ETag': '"v1"'}), 304]
+        self.assertEqual(self.api_input.read_from_url(DEVICES_URL), '{"devices": ["1"]}')
+        self.assertEqual(self.api_input.read_from_url(DEVICES_URL), '{"devices": ["1"]}')
+
+        # Second request conditional on ETag
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1].get_header('If-none-match'), '"v1"')
+        self.assertEqual(self.api_input.http_cache.misses, 1)
+        self.assertEqual(self.api_input.http_cache.validated, 1)
+
+    def test_revalidate_modified(self):
+        self.responses = [FakeResponse('v1', {'Last-Modified': 'Tue, 01 Jan 2019 00:00:00 GMT'}),
+                          FakeResponse('v2', {})]
+        self.api_input.read_from_url(DEVICES_URL)
+        self.assertEqual(self.api_input.read_from_url(DEVICES_URL), 'v2')
+        self.assertEqual(self.requests[1].get_header('If-modified-since'), 'Tue, 01 Jan 2019 00:00:00 GMT')
+        self.assertEqual(self.api_input.http_cache.get(DEVICES_URL)['body'], 'v2')
+
+    def test_immutable_not_fetched_again(self):
+        self.responses = [FakeResponse('{"hours": ["1"]}', {})]
+        self.api_input.read_from_url(OLD_DAY_URL)
+        self.assertEqual(self.api_input.read_from_url(OLD_DAY_URL), '{"hours": ["1"]}')
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.api_input.http_cache.hits, 1)
+
+    def test_not_modified_becomes_immutable(self):
+        # Cached while the day was still being uploaded
+        self.api_input.http_cache.put(OLD_DAY_URL, '{"hours": ["1"]}', '"v1"')
+        self.responses = [304]
+        self.assertEqual(self.api_input.read_from_url(OLD_DAY_URL), '{"hours": ["1"]}')
+        self.assertTrue(self.api_input.http_cache.get(OLD_DAY_URL)['immutable'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import unittest
+
+from smartem.util.jsonstream import iter_array_items
+
+
+def stream_items(doc, chunk_size):
+    return list(iter_array_items(io.StringIO(doc), chunk_size))
+
+
+class IterArrayItemsTest(unittest.TestCase):
+
+    def assert_same_as_loads(self, doc):
+        # Every chunk size, such that each token is split at every position
+        for chunk_size in range(1, len(doc) + 2):
+            self.assertEqual(stream_items(doc, chunk_size), json.loads(doc), 'chunk_size=%d' % chunk_size)
+
+    def test_empty_array(self):
+        self.assert_same_as_loads(u'[]')
+        self.assert_same_as_loads(u' [ \n ] ')
+
+    def test_scalars(self):
+        self.assert_same_as_loads(u'[1, 22,333 , -1.5e3, true, false, null, "s"]')
+
+    def test_numbers_split_over_chunks(self):
+        self.assert_same_as_loads(u'[12345, 6.789]')
+
+    def test_objects(self):
+        self.assert_same_as_loads(u'[{"location": {"latitude": "51.8600", "longitude": "5.8680"}}, {"id": 2}]')
+
+    def test_brackets_in_strings(self):
+        self.assert_same_as_loads(u'[{"a": "x,]}\\"[{"}, "]", [1, [2, "]"]]]')
+
+    def test_unicode_strings(self):
+        self.assert_same_as_loads(u'[{"name": "G\\u00f6ttingen"}, "éè"]')
+
+    def test_not_an_array(self):
+        self.assertRaises(ValueError, stream_items, u'{"a": 1}', 4)
+
+    def test_unterminated_array(self):
+        self.assertRaises(ValueError, stream_items, u'[1, 2', 2)
+        self.assertRaises(ValueError, stream_items, u'', 2)
+
+    def test_missing_separator(self):
+        self.assertRaises(ValueError, stream_items, u'[1 2]', 2)
+
+    def test_invalid_item(self):
+        self.assertRaises(ValueError, stream_items, u'[{"a": }]', 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
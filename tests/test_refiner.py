@@ -0,0 +1,111 @@
+import copy
+import random
+import unittest
+
+try:
+    from smartem.devices.josene import Josene
+    from smartem.refiner.refiner import Refiner
+except ImportError:
+    # NumPy, pytz or Stetl not installed
+    Refiner = None
+
+SENSOR_NAMES = ['temperature', 'pressure', 'humidity', 'noiseavg', 'noiselevelavg', 'co2', 'coraw',
+                'no2raw', 'o3raw', 'pm10', 'pm2_5', 'pm1']
+
+AUDIO_NAMES = ['v_audio0'] + ['v_audioplus%d' % i for i in range(1, 9)]
+
+
+def random_audio(rnd):
+    # 3 packed dB(A) bands, highest band sometimes out of range
+    return rnd.randint(20, 60) | (rnd.randint(20, 60) << 8) | (rnd.randint(0, 250) << 16)
+
+
+def random_sample(rnd, i):
+    # Josene raw sample with missing and out of range values
+    sample = {'time': '2019-01-01T03:%02d:00.000Z' % i}
+
+    def maybe(name, value, p_missing=0.1):
+        if rnd.random() > p_missing:
+            sample[name] = value
+
+    maybe('s_temperatureambient', rnd.choice([0, rnd.randint(230000, 340000), 400000]))
+    maybe('s_barometer', rnd.choice([rnd.randint(90000, 105000), 200000]))
+    maybe('s_humidity', rnd.randint(10000, 110000))
+    for name in AUDIO_NAMES:
+        maybe(name, random_audio(rnd), 0.02)
+    maybe('s_co2', rnd.randint(0, 6000000))
+    maybe('s_coresistance', rnd.randint(0, 20000000))
+    maybe('s_no2resistance', rnd.randint(0, 20000000))
+    maybe('s_o3resistance', rnd.randint(0, 20000000))
+    for name in ['s_pm10', 's_pm2_5', 's_pm1']:
+        maybe(name, rnd.randint(0, 1200000))
+
+    # Samples without location do not start a record
+    if rnd.random() > 0.3:
+        sample['s_latitude'] = (52 << 20) + 100000
+        sample['s_longitude'] = (5 << 20) + 100000
+    return sample
+
+
+def random_record(seed):
+    rnd = random.Random(seed)
+    record = {
+        'device_id': 1,
+        'device_meta': 'jose-1',
+        'gid': seed,
+        'day': 20190101,
+        'hour': 24 if seed % 7 == 0 else 3,
+        'data': {'timeseries': [random_sample(rnd, i) for i in range(rnd.randint(0, 60))]}
+    }
+    if seed % 3 == 0:
+        record['point'] = 'SRID=4326;POINT(5.1 52.1)'
+    return record
+
+
+@unittest.skipIf(Refiner is None, 'NumPy, pytz or Stetl not installed')
+class RefineColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.refiner = Refiner(Josene())
+
+    def assert_same_records(self, record_in):
+        records = self.refiner.refine(copy.deepcopy(record_in), SENSOR_NAMES)
+        records_columnar = self.refiner.refine_columnar(copy.deepcopy(record_in), SENSOR_NAMES)
+
+        records = sorted(records, key=lambda r: r['name'])
+        records_columnar = sorted(records_columnar, key=lambda r: r['name'])
+        self.assertEqual([r['name'] for r in records], [r['name'] for r in records_columnar])
+
+        for record, record_columnar in zip(records, records_columnar):
+            self.assertEqual(sorted(record.keys()), sorted(record_columnar.keys()))
+            for key in record:
+                if key in ['value', 'value_raw']:
+                    # Rounded averages, summation order may differ at .5
+                    self.assertAlmostEqual(record[key], record_columnar[key], delta=1,
+                                           msg='%s %s' % (record['name'], key))
+                elif key in ['value_min', 'value_max']:
+                    self.assertAlmostEqual(record[key], record_columnar[key], places=6,
+                                           msg='%s %s' % (record['name'], key))
+                else:
+                    self.assertEqual(record[key], record_columnar[key], '%s %s' % (record['name'], key))
+
+    def test_same_as_sample_loop(self):
+        for seed in range(100):
+            self.assert_same_records(random_record(seed))
+
+    def test_no_samples(self):
+        record_in = random_record(1)
+        record_in['data']['timeseries'] = []
+        self.assertEqual(self.refiner.refine_columnar(record_in, SENSOR_NAMES), [])
+
+    def test_invalid_noise_output_not_averaged(self):
+        # First sample: converter gives no noiseavg but leaves a partial value in the sample
+        record_in = random_record(57)
+        self.assert_same_records(record_in)
+        records = self.refiner.refine(copy.deepcopy(record_in), ['noiseavg'])
+        for record in records:
+            self.assertTrue(record['value'] is not None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+
+from smartem.util import tokenbucket
+from smartem.util.tokenbucket import TokenBucket
+
+
+class FakeTime:
+    # Clock that only advances when sleeping
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        # A real clock always advances, also for waits below float resolution
+        secs = max(secs, 1e-9)
+        self.now += secs
+        self.slept += secs
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake_time = FakeTime()
+        tokenbucket.time = self.fake_time
+
+    def tearDown(self):
+        tokenbucket.time = time
+
+    def test_default_capacity(self):
+        self.assertEqual(TokenBucket(5).capacity, 5.0)
+        self.assertEqual(TokenBucket(0.5).capacity, 1.0)
+        self.assertEqual(TokenBucket(5, 2).capacity, 2.0)
+
+    def test_burst_without_wait(self):
+        bucket = TokenBucket(10, 3)
+        for i in range(3):
+            self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(self.fake_time.slept, 0.0)
+
+    def test_rate_after_burst(self):
+        bucket = TokenBucket(10, 1)
+        bucket.acquire()
+        for i in range(10):
+            self.assertAlmostEqual(bucket.acquire(), 0.1)
+        self.assertAlmostEqual(self.fake_time.slept, 1.0)
+
+    def test_refill_upto_capacity(self):
+        bucket = TokenBucket(10, 2)
+        bucket.acquire()
+        bucket.acquire()
+
+        # Idle for long: no more than capacity available
+        self.fake_time.now += 60
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertAlmostEqual(bucket.acquire(), 0.1)
+
+    def test_multiple_tokens(self):
+        bucket = TokenBucket(2, 4)
+        self.assertEqual(bucket.acquire(4), 0.0)
+        self.assertAlmostEqual(bucket.acquire(3), 1.5)
+
+
+class TokenBucketThreadsTest(unittest.TestCase):
+
+    def test_rate_over_threads(self):
+        # 4 threads taking 40 tokens at 100/sec after a burst of 1 take at least 0.39 secs (with clock slack)
+        bucket = TokenBucket(100, 1)
+
+        def take():
+            for i in range(10):
+                bucket.acquire()
+
+        start = time.time()
+        threads = [threading.Thread(target=take) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(time.time() - start >= 0.38)
+
+
+if __name__ == '__main__':
+    unittest.main()